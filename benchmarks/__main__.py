@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+
+"""
+Headless benchmark suite of the game.
+Usage:
+
+    python3 -m benchmarks [--output <results.json>] [--compare <baseline.json>]
+
+Measures the codec, the fan-out of the server, a tick of the simulation (with
+players and with bots) and the drawing of the tanks. Results are in seconds per operation. With --compare, the
+results are compared with a baseline and regressions make the command fail.
+"""
+
+from os import environ
+environ['PYGAME_HIDE_SUPPORT_PROMPT'] = '1'
+environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+
+import sys
+import json
+import argparse
+
+from .suite import run
+
+
+def compare(results, baseline, tolerance):
+    """
+    Prints the results next to the baseline ones.
+    Returns the names of the benchmarks slower than the baseline by more than tolerance.
+    """
+    regressions = []
+    print("{:<36} {:>12} {:>12} {:>8}".format("benchmark", "baseline", "current", "ratio"))
+    for name, value in results.items():
+        if name not in baseline:
+            print("{:<36} {:>12} {:>12.3e} {:>8}".format(name, "-", value, "new"))
+            continue
+        ratio = value / baseline[name]
+        flag = ""
+        if ratio > 1 + tolerance:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print("{:<36} {:>12.3e} {:>12.3e} {:>8.2f}{}".format(name, baseline[name], value, ratio, flag))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="compare the results with this JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="slowdown ratio tolerated before flagging a regression")
+    parser.add_argument("--only", help="only run the benchmarks whose name starts with this prefix")
+    args = parser.parse_args()
+
+    report = run(args.only)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(report["results"], baseline, args.tolerance)
+        if regressions:
+            print("{} regression(s): {}".format(len(regressions), ", ".join(regressions)))
+            sys.exit(1)
+    else:
+        for name, value in report["results"].items():
+            print("{:<36} {:>12.3e}".format(name, value))
+
+
+if __name__ == '__main__':
+    main()
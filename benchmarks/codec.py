@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+
+"""
+Microbenchmark of the encoding/decoding of commands.
+Compares the former Command with the current one and the codecs.
+Usage:
+
+    python3 -m benchmarks.codec
+"""
+
+import struct
+import timeit
+
+from enum import Enum
+
+from coronatank import Config
+from coronatank import Command
+from coronatank.codec import Compact, Legacy
+
+
+class FormerCommand:
+    """
+    The former Command class, without __slots__ nor precompiled struct.
+    """
+
+    Format = 'i'*9
+    Msglen = struct.calcsize(Format)
+    States = Enum("States", "init operational destroyed left")
+
+    def __init__(self, tankid=None, state=None, angle=None, speed=None,
+                 position=None, turretangle=None, fire=None, touchedby=None):
+        self.tankid = tankid
+        self.state = state
+        self.angle = angle
+        self.speed = speed
+        self.position = position
+        if self.position is not None:
+            self.position = tuple((position[i] % Config.screen[i] for i in range(2)))
+        self.turretangle = turretangle
+        self.fire = fire
+        self.touchedby = touchedby
+        assert((self.touchedby is None) or (type(self.touchedby) == int))
+
+    def encode(self):
+        tankid = self.tankid if self.tankid is not None else -1
+        state = self.state.value if self.state is not None else -1
+        angle = self.angle if self.angle is not None else Config.maxInt
+        speed = self.speed if self.speed is not None else Config.maxInt
+        x, y = self.position if self.position is not None else (-1, -1)
+        turretangle = self.turretangle if self.turretangle is not None else Config.maxInt
+        fire = self.fire if self.fire is not None else -1
+        touchedby = self.touchedby if self.touchedby is not None else -1
+        return struct.pack(self.Format,
+                           tankid, state, angle, speed, x, y, turretangle, fire, touchedby)
+
+    def decode(self, data):
+        tankid, state, angle, speed, x, y, turretangle, fire, touchedby = struct.unpack(self.Format, data)
+        self.tankid = tankid if tankid != -1 else None
+        self.state = self.States(state) if state != -1 else None
+        self.angle = angle if angle != Config.maxInt else None
+        self.speed = speed if speed != Config.maxInt else None
+        self.position = (x, y) if x != -1 else None
+        self.turretangle = turretangle if turretangle != Config.maxInt else None
+        self.fire = fire if fire != -1 else None
+        self.touchedby = touchedby if touchedby != -1 else None
+        return self
+
+
+def measure(func, count):
+    """
+    Returns the time spent per message, in nanoseconds.
+    """
+    number = 20
+    return min(timeit.repeat(func, number=number, repeat=5)) / number / count * 1e9
+
+
+def main(count=1000):
+    former = [FormerCommand(tankid=i % 4, state=FormerCommand.States.operational, angle=i,
+                            speed=3, position=(i, 2*i), turretangle=10) for i in range(count)]
+    current = [Command(tankid=i % 4, state=Command.States.operational, angle=i,
+                       speed=3, position=(i, 2*i), turretangle=10) for i in range(count)]
+    data = b''.join(cmd.encode() for cmd in current)
+    messages = [data[i:i+Command.Msglen] for i in range(0, len(data), Command.Msglen)]
+    compact = [Compact.pack(cmd.fields()) for cmd in current]
+
+    def relay_check():
+        # As the server: the fields are unpacked, no Command is built
+        return [msg for msg, fields in Legacy.unpack(memoryview(data)) if Command.critical(fields)]
+
+    results = [
+        ("encode (former)", lambda: [cmd.encode() for cmd in former]),
+        ("encode", lambda: [cmd.encode() for cmd in current]),
+        ("encode_many", lambda: Command.encode_many(current)),
+        ("encode compact", lambda: [Compact.pack(cmd.fields()) for cmd in current]),
+        ("decode (former)", lambda: [FormerCommand().decode(msg) for msg in messages]),
+        ("decode", lambda: [Command().decode(msg) for msg in messages]),
+        ("decode compact", lambda: list(Compact.unpack(memoryview(b''.join(compact))))),
+        ("relay check (former)", lambda: [msg for msg in messages
+                                          if FormerCommand().decode(msg).state is not None]),
+        ("relay check", relay_check),
+    ]
+    print("{:<24} {:>12}".format("operation", "ns/message"))
+    for name, func in results:
+        print("{:<24} {:>12.0f}".format(name, measure(func, count)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+
+"""
+Microbenchmark of the framing of bursts of messages.
+Compares the former framing (slicing an immutable bytes buffer once per message)
+with the Framer.
+Usage:
+
+    python3 -m benchmarks.framing
+"""
+
+import timeit
+
+from coronatank import Command
+from coronatank.framing import Framer
+
+
+def slicing(burst):
+    """
+    The former framing: each message copies the rest of the buffer.
+    """
+    buffer = b''
+    buffer += burst
+    cmds = []
+    while len(buffer) >= Command.Msglen:
+        cmds.append(Command().decode(buffer[:Command.Msglen]))
+        buffer = buffer[Command.Msglen:]
+    return cmds
+
+
+def framer(burst):
+    """
+    The Framer: the whole burst is decoded in one pass.
+    """
+    framer = Framer()
+    return list(framer.commands(framer.feed(burst)))
+
+
+def main():
+    msg = Command(tankid=1, angle=45, speed=3, position=(100, 200), turretangle=10).encode()
+    print("{:>10} {:>14} {:>14} {:>8}".format("burst", "slicing (us)", "framer (us)", "gain"))
+    for kbytes in (1, 4, 16, 64, 256):
+        burst = msg * (kbytes * 1024 // Command.Msglen)
+        number = max(1, 2000 // kbytes)
+        t1 = min(timeit.repeat(lambda: slicing(burst), number=number, repeat=3)) / number
+        t2 = min(timeit.repeat(lambda: framer(burst), number=number, repeat=3)) / number
+        print("{:>8}KB {:>14.1f} {:>14.1f} {:>7.1f}x".format(kbytes, t1*1e6, t2*1e6, t1/t2))
+
+
+if __name__ == '__main__':
+    main()
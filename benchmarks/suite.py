@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+
+"""
+The benchmarks of the headless suite, see __main__.py.
+"""
+
+import io
+import random
+import timeit
+import platform
+import contextlib
+
+import pygame
+
+from coronatank import Config, Command, Tank, Pilot, BotPilot, Simulation, Wall
+from coronatank import server
+from coronatank.codec import Compact
+from coronatank.renderer import Renderer
+from coronatank.resources import Amunition
+from coronatank.navigation import Navigation
+from coronatank.projectiles import numpy
+
+
+def measure(func, number):
+    """
+    Returns the best time of a call to func, in seconds.
+    """
+    return min(timeit.repeat(func, number=number, repeat=5)) / number
+
+
+def bench_codec(count=1000):
+    """
+    Encoding and decoding of commands, per command.
+    """
+    cmds = [Command(tankid=i % 4, angle=i, speed=3, position=(i, 2*i), turretangle=10)
+            for i in range(count)]
+    messages = [cmd.encode() for cmd in cmds]
+    compact = memoryview(b''.join(Compact.pack(cmd.fields()) for cmd in cmds))
+    return {
+        "codec.encode": measure(lambda: [cmd.encode() for cmd in cmds], 10) / count,
+        "codec.decode": measure(lambda: [Command().decode(msg) for msg in messages], 10) / count,
+        "codec.encode_many": measure(lambda: Command.encode_many(cmds), 10) / count,
+        "codec.compact.encode": measure(lambda: [Compact.pack(cmd.fields()) for cmd in cmds], 10) / count,
+        "codec.compact.decode": measure(lambda: list(Compact.unpack(compact)), 10) / count,
+    }
+
+
+class MockTransport:
+    """
+    A transport counting the data written to it.
+    """
+
+    def __init__(self, port):
+        self.port = port
+        self.written = 0
+        self.writes = 0
+
+    def get_extra_info(self, name):
+        return ('127.0.0.1', self.port)
+
+    def set_write_buffer_limits(self, high, low):
+        pass
+
+    def write(self, data):
+        self.written += len(data)
+        self.writes += 1
+
+    def close(self):
+        pass
+
+
+def connect_clients(count):
+    """
+    Returns the protocols of count clients connected to the server, in one room.
+    """
+    server.Rooms.clear()
+    protocols = []
+    for i in range(count):
+        protocol = server.TankServerProtocol()
+        protocol.connection_made(MockTransport(i))
+        protocol.data_received(Command(state=Command.States.init, room=0).encode())
+        protocols.append(protocol)
+    return protocols
+
+
+def bench_fanout(sizes=(4, 16, 64)):
+    """
+    Relaying of one message from each client of a room, per round.
+    """
+    results = {}
+    # Measure rooms larger than the ones of the game
+    capacity = Config.roomCapacity
+    Config.roomCapacity = max(sizes)
+    try:
+        for coalesce in (False, True):
+            server.Coalesce = coalesce
+            for size in sizes:
+                # The server prints connection events
+                with contextlib.redirect_stdout(io.StringIO()):
+                    protocols = connect_clients(size)
+                room = protocols[0].room
+                # Each client sends the updates of its own tank
+                messages = [(protocol, Command(tankid=protocol._id, angle=45, speed=3, position=(100, 200),
+                                               turretangle=10).encode()) for protocol in protocols]
+
+                def round():
+                    for protocol, msg in messages:
+                        protocol.data_received(msg)
+                    room.flush()
+
+                name = "fanout.{}.{}".format("tick" if coalesce else "immediate", size)
+                results[name] = measure(round, 20)
+    finally:
+        Config.roomCapacity = capacity
+        server.Coalesce = False
+        server.Rooms.clear()
+    return results
+
+
+class Pressed:
+    """
+    The keys pressed by a player who drives forward and rotates.
+    """
+
+    def __init__(self, keymap):
+        self.keys = (keymap["forward"], keymap["left"], keymap["turretLeft"])
+
+    def __getitem__(self, key):
+        return 1 if key in self.keys else 0
+
+
+def battle(tanks, projectiles, vectorized=False, bots=False):
+    """
+    Returns a headless simulation with the given numbers of tanks and projectiles.
+    The tanks are driven by bots or by players pressing the same keys.
+    """
+    random.seed(0)
+    simulation = Simulation(vectorized=vectorized).headless()
+    for i in range(tanks):
+        position = (random.randint(0, Config.screen[0]), random.randint(0, Config.screen[1]))
+        pilot = BotPilot() if bots else Pilot(Config.keymap2players[0])
+        tank = Tank(position, random.randint(0, 359), Config.tanks[i % 4]["color"], pilot=pilot)
+        tank._id = i
+        simulation.add_tank(tank)
+    for i in range(projectiles):
+        position = (random.randint(0, Config.screen[0]), random.randint(0, Config.screen[1]))
+        owner = simulation.tanks[i % tanks]
+        simulation.projectiles[i] = Amunition(i, position, random.randint(0, 359), owner)
+    return simulation
+
+
+def bench_tick(sizes=((4, 50), (16, 500), (64, 2000))):
+    """
+    One tick of the simulation with N tanks and P projectiles.
+    """
+    results = {}
+    pressed = Pressed(Config.keymap2players[0])
+    modes = [False, True] if numpy is not None else [False]
+    for vectorized in modes:
+        for tanks, projectiles in sizes:
+            name = "tick.{}.{}x{}".format("numpy" if vectorized else "dict", tanks, projectiles)
+            # Projectiles leave the screen after a few dozen ticks: start from the same battle
+            timings = []
+            for _ in range(5):
+                simulation = battle(tanks, projectiles, vectorized)
+                start = timeit.default_timer()
+                for _ in range(5):
+                    simulation.step(pressed=pressed)
+                timings.append((timeit.default_timer() - start) / 5)
+            results[name] = min(timings)
+    return results
+
+
+def bench_bots(sizes=(16, 64, 256)):
+    """
+    One tick of the simulation with N tanks driven by bots, and the computation
+    of the navigation grid and of a flow field, which bots share.
+    """
+    results = {}
+    walls = [Wall(w[0], w[1]) for w in Config.walls]
+    results["bots.navigation.grid"] = measure(lambda: Navigation(walls), 5)
+    navigation = Navigation(walls)
+
+    def field():
+        navigation.fields.clear()
+        navigation.field(0)
+
+    results["bots.navigation.field"] = measure(field, 20)
+    for size in sizes:
+        timings = []
+        for _ in range(5):
+            # Warm the shared flow fields up, then measure the bots chasing each other
+            simulation = battle(size, 0, bots=True)
+            for _ in range(10):
+                simulation.step()
+            start = timeit.default_timer()
+            for _ in range(10):
+                simulation.step()
+            timings.append((timeit.default_timer() - start) / 10)
+        results["bots.tick.{}".format(size)] = min(timings)
+    return results
+
+
+def bench_draw(sizes=(4, 16, 64)):
+    """
+    Drawing of a frame with N tanks.
+    """
+    results = {}
+    pygame.init()
+    screen = pygame.display.set_mode(Config.screen)
+    pressed = Pressed(Config.keymap2players[0])
+    for size in sizes:
+        simulation = battle(size, 0)
+        results["draw.tanks.{}".format(size)] = measure(
+            lambda: [tank.draw(screen) for tank in simulation.tanks], 20)
+        for dirty in (False, True):
+            renderer = Renderer(screen, battle(size, 4 * size), dirty)
+
+            def frame():
+                renderer.simulation.step(pressed=pressed)
+                renderer.draw()
+
+            name = "draw.frame.{}.{}".format("dirty" if dirty else "full", size)
+            results[name] = measure(frame, 10)
+    return results
+
+
+def run(only=None):
+    """
+    Runs the benchmarks, returns the report.
+    """
+    results = {}
+    for bench in (bench_codec, bench_fanout, bench_tick, bench_bots, bench_draw):
+        name = bench.__name__[len("bench_"):]
+        if only and not name.startswith(only.split(".")[0]):
+            continue
+        results.update(bench())
+    if only:
+        results = {name: value for name, value in results.items() if name.startswith(only)}
+    return {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "pygame": pygame.version.ver,
+            "numpy": numpy.__version__ if numpy is not None else None,
+        },
+        "results": results,
+    }
@@ -2,5 +2,6 @@
 
 from .config import Config
 from .command import Command
-from .resources import Tank, Turret, Pilot, Wall
+from .resources import Tank, Turret, Pilot, BotPilot, Wall
+from .simulation import Simulation
 from .client import Client
@@ -2,33 +2,85 @@
 
 """
 This file contains the TCP client used by the game to synchronize with the server.
+Optionally, the state updates can be exchanged over UDP.
 """
 
 
+import time
 import socket
+import selectors
+import threading
 
-from collections import defaultdict
+from collections import defaultdict, deque
 
+from . import Config
 from . import Command
 from . import Tank
+from .codec import Codecs, Compact, Legacy
+from .framing import Framer, ClientHeader, RecordHeader, is_newer, records
+from .jitter import JitterBuffer
+from .snapshot import Reader
 
 
 class Client:
     """
     A TCP client to connect to the server and exchange tanks positions, angles, etc.
+    In UDP mode, the state updates go over UDP once the server acknowledged
+    the address of the client, the events (fire, destroyed, etc.) still go over TCP.
+
+    Once connected, a background thread does the network I/O: it drains the sockets
+    as soon as data arrives, decodes the commands and hands them over to the game
+    loop through a deque (whose append and popleft are atomic, so no lock is needed).
+    It also writes the data queued by the game loop, without ever spinning on the socket.
     """
 
-    def __init__(self, ip, port, tanks):
+    def __init__(self, ip, port, tanks, room=None, codec=Compact, udp=False, spectator=False,
+                 snapshots=False):
         self.ip = ip
         self.port = port
+        # The room to join, None to let the server pick one
+        self.room = room
+        # The codec to request, the legacy one is used until the server accepts it
+        self.requestedCodec = codec
+        self.codec = Legacy
         self.tanks = tanks
-        assert(len(tanks) == 1)
+        # A spectator has no tank and only receives
+        self.spectator = spectator
+        assert(len(tanks) == (0 if spectator else 1))
+        # Snapshots of the room are requested, they are used if the server accepts
+        self.requestedSnapshots = snapshots
+        self.snapshots = False
+        self.reader = Reader()
         self.socket = None
-        self.data = b''
+        self.framer = Framer()
         # The list of tanks controlled remotely
         self.remoteTanks = {}
-        # The last received command from tanks controlled remotely
-        self._lastCommandReceived = defaultdict(lambda: [])
+        # The commands received from tanks controlled remotely
+        self._lastCommandReceived = defaultdict(JitterBuffer)
+        # UDP mode
+        self.udp = udp
+        self.udpSocket = None
+        self.udpConfirmed = False
+        self._lastHello = 0
+        # The sequence number of the last state update sent over UDP
+        self.sequence = 0
+        # The last state sent and when, so that only changes (and keepalives) are sent
+        self._lastState = None
+        self._lastSent = 0
+        # The messages of the current frame, sent in a single write by flush
+        self._frame = []
+        # The sequence number of the last state update received from each remote tank
+        self._lastSequence = {}
+        # The (time of reception, command) decoded by the I/O thread
+        self.inbox = deque()
+        # The data to send over TCP, written by the I/O thread
+        self.outbox = deque()
+        # The I/O thread, woken up through a pair of sockets when there is data to send
+        self.thread = None
+        self.running = False
+        self._wakeup = None
+        # The error which stopped the I/O thread, if any
+        self.error = None
 
     def connect(self):
         """
@@ -37,70 +89,261 @@ class Client:
         # Connect to the server
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         err = self.socket.connect((self.ip, self.port))
-        self.socket.setblocking(0)
+        # The messages of a frame are written at once, no need to wait for more
+        self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
         # Send ID request
-        self.send_command(Command(state=Command.States.init))
-        # Receive ID of the local tank
-        while len(self.data) < Command.Msglen:
-            self._recv_data(Command.Msglen - len(self.data))
-        cmd = Command().decode(self.data[:Command.Msglen])
-        self.data = self.data[Command.Msglen:]
+        self.socket.sendall(Command(state=Command.States.init, room=self.room,
+                                    codec=self.requestedCodec._id, spectator=self.spectator,
+                                    snapshots=self.requestedSnapshots).encode())
+        # Receive ID of the local tank, its room and the codec to use.
+        # Read no further: the next messages may use the new codec.
+        chunk = b''
+        while len(chunk) == 0:
+            chunk = self.framer.feed(self._recv_data(Command.Msglen - len(self.framer)))
+        self.socket.setblocking(0)
+        cmd = Command().decode(chunk)
+        if cmd.room is not None:
+            self.room = cmd.room
+        # Old servers do not answer with a codec and keep using the legacy one
+        self.codec = Codecs.get(cmd.codec, Legacy)
+        self.framer.codec = self.codec
+        self.snapshots = cmd.snapshots
         # Update the local tank
-        assert(len(self.tanks) == 1)
-        self.tanks[0].init_from_id(cmd.tankid)
+        if not self.spectator:
+            self.tanks[0].init_from_id(cmd.tankid)
+        # Register the UDP address of the client (old servers have no room and no UDP)
+        if self.udp and self.room is not None and not self.spectator:
+            self.udpSocket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.udpSocket.connect((self.ip, self.port))
+            self.udpSocket.setblocking(0)
+            self._send_hello()
+        self.start()
+
+    def start(self):
+        """
+        Starts the I/O thread.
+        """
+        self._wakeup = socket.socketpair()
+        for sock in self._wakeup:
+            sock.setblocking(0)
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name="network", daemon=True)
+        self.thread.start()
+
+    def close(self):
+        """
+        Stops the I/O thread and closes the connection.
+        """
+        self.running = False
+        self._wake()
+        self.thread.join()
+        self.socket.close()
 
     def recv_command(self, tankid):
         """
-        Returns the last command or None.
+        Returns the command to execute now or None.
         Called by remotePilots to get last command from the server.
         """
-        if len(self._lastCommandReceived[tankid]) == 0:
-            return None
-        return self._lastCommandReceived[tankid].pop()
+        return self._lastCommandReceived[tankid].command(time.time())
 
     def send_command(self, cmd):
         """
         Called by Pilots to transmit commands to the server.
+        A state update is only sent if the state changed or to keep the tank alive,
+        and goes out with the others of the frame on flush. Events go out right away.
         """
-        self._send_data(cmd.encode())
+        critical = cmd.is_critical()
+        state = (cmd.angle, cmd.speed, cmd.position, cmd.turretangle)
+        now = time.time()
+        if not critical and state == self._lastState and now < self._lastSent + Config.keepalivePeriod:
+            return
+        self._lastState, self._lastSent = state, now
+        udpSocket = self.udpSocket
+        if self.udpConfirmed and udpSocket is not None and not critical:
+            self.sequence = (self.sequence + 1) % 2**32
+            header = ClientHeader.pack(self.room, cmd.tankid, self.sequence)
+            udpSocket.send(header + self.codec.pack(cmd.fields()))
+        else:
+            self._frame.append(self.codec.pack(cmd.fields()))
+            if critical:
+                self.flush()
+
+    def flush(self):
+        """
+        Sends the commands of the frame, in a single write.
+        Called by the game loop at the end of each frame.
+        """
+        if self._frame:
+            self._send_data(b''.join(self._frame))
+            self._frame = []
 
     def synchronize(self):
         """
-        Receives the commands from the server, executes or stores them.
-        """
-        # Read commands received from the server
-        self._recv_data()
-        while len(self.data) >= Command.Msglen:
-            # Read a new command
-            cmd = Command().decode(self.data[:Command.Msglen])
-            self.data = self.data[Command.Msglen:]
-            # Remove disconnected tank
-            if cmd.state == Command.States.left:
-                del(self.remoteTanks[cmd.tankid])
-                del(self._lastCommandReceived[cmd.tankid])
-            # Store received command, the RemotePilot will read it later
-            else:
-                # If this is a new tank, create and initialize it
-                if cmd.tankid not in self.remoteTanks:
-                    self.remoteTanks[cmd.tankid] = Tank().init_from_id(cmd.tankid)
-                # Queue received command
-                self._lastCommandReceived[cmd.tankid].insert(0, cmd)
+        Executes or stores the commands received from the server since last call.
+        """
+        if self.error is not None:
+            raise RuntimeError("Connection with server broken.") from self.error
+        inbox = self.inbox
+        while inbox:
+            now, cmd = inbox.popleft()
+            self._receive(cmd, now)
+        if self.udpSocket is not None and not self.udpConfirmed and time.time() > self._lastHello + 1:
+            self._send_hello()
         return list(self.remoteTanks.values())
 
+    def _receive(self, cmd, now):
+        """
+        Executes or stores a command received from the server at time now.
+        """
+        # Remove disconnected tank
+        if cmd.state == Command.States.left:
+            self.remoteTanks.pop(cmd.tankid, None)
+            self._lastCommandReceived.pop(cmd.tankid, None)
+        # Store received command, the RemotePilot will read it later
+        else:
+            # If this is a new tank, create and initialize it
+            if cmd.tankid not in self.remoteTanks:
+                self.remoteTanks[cmd.tankid] = Tank().init_from_id(cmd.tankid)
+            # Queue received command
+            self._lastCommandReceived[cmd.tankid].push(cmd, now)
+
+    def _run(self):
+        """
+        The loop of the I/O thread.
+        """
+        try:
+            self._loop()
+        except Exception as exc:
+            self.error = exc
+            self.running = False
+
+    def _loop(self):
+        selector = selectors.DefaultSelector()
+        selector.register(self.socket, selectors.EVENT_READ, self._drain)
+        selector.register(self._wakeup[0], selectors.EVENT_READ, None)
+        if self.udpSocket is not None:
+            selector.register(self.udpSocket, selectors.EVENT_READ, self._drain_datagrams)
+        # The data taken from the outbox but not sent yet
+        pending = bytearray()
+        while self.running:
+            for key, mask in selector.select():
+                if key.fileobj is self._wakeup[0]:
+                    self._drain_wakeup()
+                elif mask & selectors.EVENT_READ:
+                    if not key.data():
+                        selector.unregister(key.fileobj)
+            # Send the data queued, the rest when the socket is writable again
+            outbox = self.outbox
+            while outbox:
+                pending += outbox.popleft()
+            if pending:
+                try:
+                    sent = self.socket.send(pending)
+                except BlockingIOError:
+                    sent = 0
+                del pending[:sent]
+            events = selectors.EVENT_READ | (selectors.EVENT_WRITE if pending else 0)
+            if selector.get_key(self.socket).events != events:
+                selector.modify(self.socket, events, self._drain)
+        selector.close()
+
+    def _drain(self):
+        """
+        Reads and decodes all the data received over TCP.
+        """
+        while True:
+            data = self._recv_data(65536)
+            if not data:
+                return True
+            now = time.time()
+            for cmd in self.framer.commands(self.framer.feed(data)):
+                if cmd.state == Command.States.snapshot or self.reader.reading():
+                    self._read_snapshot(cmd, now)
+                    continue
+                if cmd.state == Command.States.left:
+                    self._lastSequence.pop(cmd.tankid, None)
+                self.inbox.append((now, cmd))
+
+    def _read_snapshot(self, cmd, now):
+        """
+        Reads a command of a snapshot. Once complete, hands the state of
+        each remote tank over to the game loop and acknowledges it.
+        """
+        snapshot = self.reader.read(cmd)
+        if snapshot is None:
+            return
+        number, tanks, left = snapshot
+        local = [tank._id for tank in self.tanks]
+        for tankid, (angle, speed, position, turretangle) in tanks.items():
+            if tankid not in local:
+                self.inbox.append((now, Command(tankid=tankid, angle=angle, speed=speed, position=position,
+                                                turretangle=turretangle)))
+        for tankid in left:
+            self.inbox.append((now, Command(tankid=tankid, state=Command.States.left)))
+        # The I/O thread sends its outbox right after reading
+        self.outbox.append(self.codec.pack(Command(state=Command.States.ack, fire=number).fields()))
+
+    def _drain_wakeup(self):
+        try:
+            while self._wakeup[0].recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+
+    def _wake(self):
+        """
+        Wakes the I/O thread up.
+        """
+        try:
+            self._wakeup[1].send(b'\x00')
+        except BlockingIOError:
+            # The thread has not woken up since the last time
+            pass
+
+    def _send_hello(self):
+        """
+        Internal method to register the UDP address of the client to the server.
+        """
+        self._lastHello = time.time()
+        self.udpSocket.send(ClientHeader.pack(self.room, self.tanks[0]._id, 0))
+
+    def _drain_datagrams(self):
+        """
+        Internal method to read all the datagrams received from the server.
+        Keeps the state updates more recent than the last ones received.
+        Returns False once the server refused UDP.
+        """
+        while True:
+            try:
+                data = self.udpSocket.recv(65536)
+            except BlockingIOError:
+                return True
+            except ConnectionRefusedError:
+                print("The server does not accept UDP, using TCP only.")
+                self.udpConfirmed = False
+                self.udpSocket = None
+                return False
+            # A datagram without record acknowledges the address of the client
+            if len(data) < RecordHeader.size:
+                self.udpConfirmed = True
+                continue
+            now = time.time()
+            for tankid, sequence, msg, fields in records(data, self.codec):
+                if is_newer(sequence, self._lastSequence.get(tankid)):
+                    self._lastSequence[tankid] = sequence
+                    self.inbox.append((now, Command().decode_fields(fields)))
+
     def _send_data(self, msg):
         """
-        Internal method to send data to the server.
+        Internal method to queue data for the I/O thread.
         """
-        totalsent = 0
-        while totalsent < len(msg):
-            sent = self.socket.send(msg[totalsent:])
-            if sent == 0:
-                raise RuntimeError("Connection with server broken.")
-            totalsent += sent
+        self.outbox.append(msg)
+        self._wake()
 
     def _recv_data(self, maxdata=128):
         """
         Internal method to recv data from the server.
+        Returns the data received, possibly empty.
         """
         try:
             data = self.socket.recv(maxdata)
@@ -108,4 +351,4 @@ class Client:
                 raise RuntimeError("Connection with server broken.")
         except BlockingIOError:
             data = b''
-        self.data += data
+        return data
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+
+"""
+This file contains the codecs used to exchange commands over the network.
+Both work on the tuple of integers returned by Command.fields().
+"""
+
+import struct
+
+from . import Config
+from . import Command
+
+
+# The values of the fields of Command.fields() which are not set
+Unset = (-1, -1, Config.maxInt, Config.maxInt, -1, -1, Config.maxInt, -1, -1)
+
+
+class LegacyCodec:
+    """
+    The original format: nine 32 bits integers per message, unset fields
+    being sent as -1 or Config.maxInt.
+    """
+
+    _id = 0
+
+    def pack(self, fields):
+        """
+        Returns the message encoding fields.
+        """
+        return Command.Struct.pack(*fields)
+
+    def length(self, buffer, offset=0):
+        """
+        Returns the length of the message starting at offset.
+        """
+        return Command.Msglen
+
+    def complete(self, buffer):
+        """
+        Returns the length of the complete messages at the beginning of buffer.
+        """
+        return len(buffer) - len(buffer) % Command.Msglen
+
+    def unpack(self, chunk):
+        """
+        Iterates over the (message, fields) of a chunk of complete messages.
+        The messages are zero-copy views on the chunk.
+        """
+        offsets = range(0, len(chunk), Command.Msglen)
+        for offset, fields in zip(offsets, Command.Struct.iter_unpack(chunk)):
+            yield chunk[offset:offset+Command.Msglen], fields
+
+
+class CompactCodec:
+    """
+    A variable length format: a first byte tells which fields are set and
+    only those are sent, with the narrowest encoding they fit in.
+    Angles are sent modulo 360.
+    A movement update takes 11 bytes instead of 36.
+    """
+
+    _id = 1
+
+    # Encoding of each field, in the order of Command.fields().
+    # Position is a single field made of the two coordinates.
+    Formats = ('B', 'B', 'H', 'b', 'HH', 'H', 'I', 'I')
+    Indices = (0, 1, 2, 3, 4, 6, 7, 8)
+    # The range of each field of Command.fields() once set, None for the angles
+    Ranges = ((0, 0xff), (0, 0xff), None, (-0x80, 0x7f), (0, 0xffff), (0, 0xffff), None,
+              (0, 0xffffffff), (0, 0xffffffff))
+
+    def __init__(self):
+        # The struct and the indices in Command.fields() of the values of each mask
+        self.layouts = []
+        for mask in range(256):
+            fmt, indices = '<B', []
+            for bit, field in enumerate(self.Formats):
+                if mask & (1 << bit):
+                    fmt += field
+                    indices.extend((4, 5) if field == 'HH' else (self.Indices[bit],))
+            self.layouts.append((struct.Struct(fmt), tuple(indices)))
+        self.sizes = [layout.size for layout, _ in self.layouts]
+
+    def pack(self, fields):
+        """
+        Returns the message encoding fields.
+        """
+        tankid, state, angle, speed, x, y, turretangle, fire, touchedby = fields
+        mask, values = 0, []
+        if tankid != -1:
+            mask |= 1
+            values.append(tankid)
+        if state != -1:
+            mask |= 2
+            values.append(state)
+        if angle != Config.maxInt:
+            mask |= 4
+            values.append(angle % 360)
+        if speed != Config.maxInt:
+            mask |= 8
+            values.append(speed)
+        if x != -1:
+            mask |= 16
+            values.append(x)
+            values.append(y)
+        if turretangle != Config.maxInt:
+            mask |= 32
+            values.append(turretangle % 360)
+        if fire != -1:
+            mask |= 64
+            values.append(fire)
+        if touchedby != -1:
+            mask |= 128
+            values.append(touchedby)
+        return self.layouts[mask][0].pack(mask, *values)
+
+    def fits(self, fields):
+        """
+        Tells if the fields set fit in their encoding, i.e. if pack accepts them.
+        """
+        for i, (value, bounds) in enumerate(zip(fields, self.Ranges)):
+            # The second coordinate is set along with the first one
+            unset = fields[4] == Unset[4] if i == 5 else value == Unset[i]
+            if bounds is None or unset:
+                continue
+            if not bounds[0] <= value <= bounds[1]:
+                return False
+        return True
+
+    def length(self, buffer, offset=0):
+        """
+        Returns the length of the message starting at offset.
+        """
+        return self.sizes[buffer[offset]]
+
+    def complete(self, buffer):
+        """
+        Returns the length of the complete messages at the beginning of buffer.
+        """
+        offset, length, sizes = 0, len(buffer), self.sizes
+        while offset < length:
+            size = sizes[buffer[offset]]
+            if offset + size > length:
+                break
+            offset += size
+        return offset
+
+    def unpack(self, chunk):
+        """
+        Iterates over the (message, fields) of a chunk of complete messages.
+        The messages are zero-copy views on the chunk.
+        """
+        offset = 0
+        while offset < len(chunk):
+            layout, indices = self.layouts[chunk[offset]]
+            fields = [-1, -1, Config.maxInt, Config.maxInt, -1, -1, Config.maxInt, -1, -1]
+            for index, value in zip(indices, layout.unpack_from(chunk, offset)[1:]):
+                fields[index] = value
+            yield chunk[offset:offset+layout.size], tuple(fields)
+            offset += layout.size
+
+
+Legacy = LegacyCodec()
+Compact = CompactCodec()
+
+# The codecs by ID, as negotiated in init commands.
+Codecs = {codec._id: codec for codec in (Legacy, Compact)}
@@ -15,50 +15,138 @@ class Command:
     """
     A command produced by a pilot and executed by a tank.
     Possibly exchanged over the network.
+
+    An init command never fires nor gets hit: on the wire, its 'fire' field
+    carries the room and its 'touchedby' field the codec requested by the client
+    (or assigned by the server). Its 'speed' field is a set of flags: 1 for a
+    spectator, 2 for a client requesting (or granted) snapshots.
+
+    A snapshot command heads a snapshot of the room sent by the server (see snapshot.py):
+    its 'fire' field carries its number, its 'touchedby' field the number of the snapshot
+    it is a delta of (none for a keyframe) and its 'speed' field the number of tank
+    states which follow. An ack command acknowledges, in its 'fire' field, the last
+    snapshot received by the client.
     """
 
     Format = 'i'*9
     Msglen = struct.calcsize(Format)
-    States = Enum("States", "init operational destroyed left")
+    Struct = struct.Struct(Format)
+    States = Enum("States", "init operational destroyed left snapshot ack")
+    StatesByValue = dict([(-1, None)] + [(state.value, state) for state in States])
+
+    __slots__ = ('tankid', 'state', 'angle', 'speed', 'position', 'turretangle',
+                 'fire', 'touchedby', 'room', 'codec', 'spectator', 'snapshots')
 
     def __init__(self, tankid=None, state=None, angle=None, speed=None,
-                 position=None, turretangle=None, fire=None, touchedby=None):
+                 position=None, turretangle=None, fire=None, touchedby=None, room=None,
+                 codec=None, spectator=False, snapshots=False):
         self.tankid = tankid
         self.state = state
         self.angle = angle
         self.speed = speed
         self.position = position
-        if self.position is not None:
-            self.position = tuple((position[i] % Config.screen[i] for i in range(2)))
+        if position is not None:
+            self.position = (position[0] % Config.screen[0], position[1] % Config.screen[1])
         self.turretangle = turretangle
         self.fire = fire
         self.touchedby = touchedby
         assert((self.touchedby is None) or (type(self.touchedby) == int))
+        self.room = room
+        self.codec = codec
+        self.spectator = spectator
+        self.snapshots = snapshots
 
     def encode(self):
-        tankid = self.tankid if self.tankid is not None else -1
-        state = self.state.value if self.state is not None else -1
-        angle = self.angle if self.angle is not None else Config.maxInt
-        speed = self.speed if self.speed is not None else Config.maxInt
-        x, y = self.position if self.position is not None else (-1, -1)
-        turretangle = self.turretangle if self.turretangle is not None else Config.maxInt
-        fire = self.fire if self.fire is not None else -1
-        touchedby = self.touchedby if self.touchedby is not None else -1
-        return struct.pack(self.Format,
-                           tankid, state, angle, speed, x, y, turretangle, fire, touchedby)
+        state, position = self.state, self.position
+        if state is self.States.init:
+            return self.Struct.pack(*self.fields())
+        # Same as packing fields(), without building the tuple
+        maxInt = Config.maxInt
+        if position is None:
+            position = (-1, -1)
+        return self.Struct.pack(self.tankid if self.tankid is not None else -1,
+                                state._value_ if state is not None else -1,
+                                self.angle if self.angle is not None else maxInt,
+                                self.speed if self.speed is not None else maxInt,
+                                position[0], position[1],
+                                self.turretangle if self.turretangle is not None else maxInt,
+                                self.fire if self.fire is not None else -1,
+                                self.touchedby if self.touchedby is not None else -1)
+
+    def fields(self):
+        """
+        Returns the tuple of integers sent over the network.
+        """
+        state, position, speed = self.state, self.position, self.speed
+        # An init command carries the room, the codec and the flags instead of fire,
+        # touchedby and speed
+        if state is self.States.init:
+            fire, touchedby = self.room, self.codec
+            if self.spectator or self.snapshots:
+                speed = self.spectator | self.snapshots << 1
+        else:
+            fire, touchedby = self.fire, self.touchedby
+        # ('_value_' is a plain attribute, much faster than the 'value' property)
+        return (self.tankid if self.tankid is not None else -1,
+                state._value_ if state is not None else -1,
+                self.angle if self.angle is not None else Config.maxInt,
+                speed if speed is not None else Config.maxInt,
+                position[0] if position is not None else -1,
+                position[1] if position is not None else -1,
+                self.turretangle if self.turretangle is not None else Config.maxInt,
+                fire if fire is not None else -1,
+                touchedby if touchedby is not None else -1)
 
     def decode(self, data):
-        tankid, state, angle, speed, x, y, turretangle, fire, touchedby = struct.unpack(self.Format, data)
+        return self.decode_fields(self.Struct.unpack(data))
+
+    def decode_fields(self, fields):
+        """
+        Decodes the tuple of integers unpacked from a message.
+        """
+        tankid, state, angle, speed, x, y, turretangle, fire, touchedby = fields
         self.tankid = tankid if tankid != -1 else None
-        self.state = self.States(state) if state != -1 else None
+        self.state = self.StatesByValue[state]
         self.angle = angle if angle != Config.maxInt else None
         self.speed = speed if speed != Config.maxInt else None
         self.position = (x, y) if x != -1 else None
         self.turretangle = turretangle if turretangle != Config.maxInt else None
         self.fire = fire if fire != -1 else None
         self.touchedby = touchedby if touchedby != -1 else None
+        self.room = None
+        self.codec = None
+        self.spectator = False
+        self.snapshots = False
+        if self.state is self.States.init:
+            self.room, self.fire = self.fire, None
+            self.codec, self.touchedby = self.touchedby, None
+            flags, self.speed = self.speed or 0, None
+            self.spectator, self.snapshots = bool(flags & 1), bool(flags & 2)
         return self
 
+    def is_critical(self):
+        """
+        Tells if the command carries an event (state change, fire, hit) which must
+        not be dropped, as opposed to a plain state update superseded by the next one.
+        """
+        return self.state is not None or self.fire is not None or self.touchedby is not None
+
+    @staticmethod
+    def critical(fields):
+        """
+        Same as is_critical, on the tuple of integers of an encoded command.
+        """
+        return fields[1] != -1 or fields[7] != -1 or fields[8] != -1
+
+    @staticmethod
+    def encode_many(cmds):
+        """
+        Encodes a list of commands into a single buffer.
+        """
+        return b''.join([cmd.encode() for cmd in cmds])
+
     def __repr__(self):
-        return "<Cmd {} {} {} {} {} {} {} {}>".format(self.tankid, self.state, self.angle, self.speed,
-                                                  self.position, self.turretangle, self.fire, self.touchedby)
+        return "<Cmd {} {} {} {} {} {} {} {} {} {}>".format(self.tankid, self.state, self.angle, self.speed,
+                                                        self.position, self.turretangle, self.fire,
+                                                        self.touchedby, self.room, self.codec)
+
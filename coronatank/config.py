@@ -12,6 +12,10 @@ class Config:
 
     fps = 50
     screen = (800, 600)
+    floorColor = (220, 220, 220, 0)
+
+    # In dirty rects mode, the whole screen is redrawn when more than this ratio changed
+    dirtyThreshold = 0.3
 
     maxInt = 99999999
 
@@ -20,6 +24,13 @@ class Config:
     tankDeltaAngle = 6
     tankDeathDuration = 5
 
+    # Size of the cells of the grid used to detect collisions
+    gridCellSize = 64
+
+    # Sprites of the tanks are pre-rendered every few degrees, up to a few megabytes
+    spriteAngleStep = 2
+    spriteCacheBytes = 8 * 1024 * 1024
+
     turretColor = (50, 50, 50, 255)
     turretDeltaAngle = 2
 
@@ -34,6 +45,42 @@ class Config:
         {"position": (50, -50), "angle": 45, "color": (150, 50, 20, 255)}
     ]
 
+    # Remote tanks are displayed with a delay (in seconds) to smooth the network jitter
+    remoteDelay = 0.1
+    remoteBufferSize = 32
+    remoteMaxExtrapolation = 0.25
+
+    # The state of a local tank is only sent when it changes, or after this many seconds
+    keepalivePeriod = 1
+
+    # The number of snapshots of each room kept by the server (and the clients)
+    # to send (and read) deltas against them
+    snapshotHistory = 32
+
+    # A room (i.e. a match) hosts at most one player per tank above
+    roomCapacity = len(tanks)
+
+    # Write buffer of the server for each client, in bytes: above the high mark, only
+    # the last state of each tank is kept for the client until it drains below the low mark
+    clientHighWater = 64 * 1024
+    clientLowWater = 16 * 1024
+    # A client congested for longer than this (in seconds) is disconnected
+    clientMaxCongestion = 10
+
+    # Each client may send this many commands per frame (or per tick of the server,
+    # if faster), with bursts of up to inboundBurst seconds of commands
+    inboundPerTick = 2
+    inboundBurst = 0.5
+
+    # The bots find their way on a grid of cells of this size (in pixels). They chase the
+    # closest tank within botSight pixels, looking for one every botScanPeriod ticks, and fire
+    # when their turret is aimed within botAimTolerance degrees, at most every botFirePeriod seconds.
+    navigationCellSize = 20
+    botSight = 300
+    botScanPeriod = 10
+    botAimTolerance = 4
+    botFirePeriod = 1
+
     # Walls can only be vertical or horizontal.
     # The first coordindate MUST be at the top-left.
     walls = [
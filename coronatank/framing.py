@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+
+"""
+This file contains the framing of the messages exchanged over the network.
+
+In UDP mode, the state updates are exchanged in datagrams:
+ - a datagram sent by a client is a ClientHeader (room, tank ID, sequence number)
+   followed by at most one message. An empty one registers the client's address.
+ - a datagram sent by the server is a list of records, each of them being
+   a RecordHeader (tank ID, sequence number) followed by a message.
+   A datagram shorter than a RecordHeader acknowledges the registration of
+   the client's address (asyncio does not send empty datagrams).
+Sequence numbers let receivers drop the updates older than the last one received.
+"""
+
+import struct
+
+from . import Command
+from .codec import Legacy
+
+
+ClientHeader = struct.Struct('<iBI')
+RecordHeader = struct.Struct('<BI')
+Acknowledgement = b'\x00'
+
+
+def is_newer(sequence, last):
+    """
+    Tells if a sequence number is more recent than the last one received (or None).
+    Sequence numbers are 32 bits integers and wrap around.
+    """
+    return last is None or 0 < (sequence - last) % 2**32 < 2**31
+
+
+def records(data, codec):
+    """
+    Iterates over the (tank ID, sequence number, message, fields) of a datagram sent by the server.
+    Stops at the first truncated record.
+    """
+    data = memoryview(data)
+    offset = 0
+    while offset + RecordHeader.size < len(data):
+        tankid, sequence = RecordHeader.unpack_from(data, offset)
+        offset += RecordHeader.size
+        length = codec.length(data, offset)
+        if offset + length > len(data):
+            return
+        for msg, fields in codec.unpack(data[offset:offset+length]):
+            yield tankid, sequence, msg, fields
+        offset += length
+
+
+class Framer:
+    """
+    Splits a stream of bytes into messages of the given codec.
+    Received data are accumulated in a bytearray and complete messages are
+    decoded in one pass, without copying the rest of the stream for each of them.
+    """
+
+    def __init__(self, codec=Legacy):
+        self.codec = codec
+        self.buffer = bytearray()
+
+    def __len__(self):
+        return len(self.buffer)
+
+    def feed(self, data):
+        """
+        Appends data to the buffer.
+        Returns a memoryview on all the complete messages received so far,
+        which are removed from the buffer.
+        """
+        self.buffer += data
+        end = self.codec.complete(self.buffer)
+        if end == 0:
+            return memoryview(b'')
+        chunk = bytes(self.buffer[:end])
+        del self.buffer[:end]
+        return memoryview(chunk)
+
+    def messages(self, chunk):
+        """
+        Iterates over the (message, fields) of a chunk returned by feed.
+        The messages are zero-copy views on the chunk.
+        """
+        return self.codec.unpack(chunk)
+
+    def commands(self, chunk):
+        """
+        Iterates over the commands of a chunk returned by feed.
+        """
+        for _, fields in self.codec.unpack(chunk):
+            yield Command().decode_fields(fields)
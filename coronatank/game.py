@@ -4,9 +4,12 @@
 The main file of the game.
 Usage:
 
-    python3 game.py
+    python3 game.py [--bots <number>]
 or
-    python3 game.py --server <ip:port>
+    python3 game.py --server <ip:port> [--room <room>] [--udp] [--spectate] [--snapshots]
+
+With --bots, a single player fights tanks driven by the computer.
+Add --dirty to only redraw the parts of the screen which changed.
 """
 
 from os import environ
@@ -17,8 +20,10 @@ import pygame
 import argparse
 
 from . import Config
-from . import Tank, Turret, Pilot, Wall
+from . import Tank, Turret, Pilot, BotPilot, Wall
 from . import Client
+from . import Simulation
+from .renderer import Renderer
 
 
 def main():
@@ -26,12 +31,19 @@ def main():
     # Parsing command line
     parser = argparse.ArgumentParser()
     parser.add_argument("--server", help="IP:port of the server")
+    parser.add_argument("--room", type=int, help="room (i.e. match) to join on the server")
+    parser.add_argument("--udp", action="store_true", help="send tanks positions over UDP")
+    parser.add_argument("--spectate", action="store_true", help="watch the match without playing")
+    parser.add_argument("--snapshots", action="store_true",
+                        help="receive snapshots of the room instead of the updates of each tank")
+    parser.add_argument("--bots", type=int, default=0, help="play alone against this many bots")
+    parser.add_argument("--dirty", action="store_true", help="only redraw the parts of the screen which changed")
     args = parser.parse_args()
     mode = "local"
     if args.server:
         ip, port = args.server.split(":")
         port = int(port)
-        mode = "server"
+        mode = "spectator" if args.spectate else "server"
 
     # Init screen
     pygame.init()
@@ -40,13 +52,15 @@ def main():
     fpsClock = pygame.time.Clock()
 
     # prepare the battlefield
-    tanks, walls = setBattleField(mode)
-    projectiles = {}
+    tanks, walls = setBattleField(mode, args.bots)
+    simulation = Simulation(tanks, walls)
+    renderer = Renderer(screen, simulation, args.dirty)
 
     # Connect to the server
     client = None
-    if mode == "server":
-        client = Client(ip, port, tanks)
+    if mode in ("server", "spectator"):
+        client = Client(ip, port, tanks, args.room, udp=args.udp, spectator=(mode == "spectator"),
+                        snapshots=args.snapshots)
         client.connect()
 
     while True:
@@ -69,34 +83,38 @@ def main():
             remoteTanks = client.synchronize()
 
         # Compute new positions
-        for obj in tanks + remoteTanks + list(projectiles.values()):
-            obj.update(events, pressed, projectiles, walls, tanks, client)
-
-        # Remove projectiles which have left the screen
-        maxX, maxY = Config.screen
-        for projectile in list(projectiles.values()):
-            projX, projY = projectile.position
-            if not ((0 <= projX <= maxX) and (0 <= projY <= maxY)):
-                del(projectiles[projectile._id])
+        simulation.step(events=events, pressed=pressed, client=client, remoteTanks=remoteTanks)
+        if client:
+            client.flush()
 
         # Redraw boards
-        screen.fill((220, 220, 220, 0))
-        for obj in walls + tanks + remoteTanks + list(projectiles.values()):
-            obj.draw(screen)
-        pygame.display.update()
+        renderer.draw()
 
         # Ensure constant FPS
         fpsClock.tick(Config.fps)
 
 
-def setBattleField(mode):
+def setBattleField(mode, bots=0):
     """
     Prepare the tanks and walls of the battlefield.
-    Parameter 'mode' can be "local" or "server".
+    Parameter 'mode' can be "local", "server" or "spectator".
+    In 'local' mode, 'bots' tanks driven by the computer fight a single player.
     """
-    # Prepare tanks (2 if 'local' mode, 1 if 'server' mode) and client.
+    # Prepare tanks (2 if 'local' mode, 1 if 'server' mode, none if 'spectator' mode) and client.
     tanks = []
-    if mode == "local":
+    if mode == "local" and bots > 0:
+        tanks.append(Tank(Config.tanks[0]["position"],
+                          Config.tanks[0]["angle"],
+                          Config.tanks[0]["color"],
+                          Turret(),
+                          Pilot(Config.keymap1player)))
+        for i in range(1, bots + 1):
+            tanks.append(Tank(Config.tanks[i % len(Config.tanks)]["position"],
+                              Config.tanks[i % len(Config.tanks)]["angle"],
+                              Config.tanks[i % len(Config.tanks)]["color"],
+                              Turret(),
+                              BotPilot()))
+    elif mode == "local":
         for i in range(2):
             t = Tank(Config.tanks[i]["position"],
                      Config.tanks[i]["angle"],
@@ -111,6 +129,8 @@ def setBattleField(mode):
                  Turret(),
                  Pilot(Config.keymap1player))
         tanks.append(t)
+    elif mode == "spectator":
+        pass
     else:
         raise RuntimeError("The mode '{}' doesn't exist.".format(mode))
     # Prepare walls
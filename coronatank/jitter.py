@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+
+"""
+This file contains the jitter buffer used to display remote tanks smoothly.
+"""
+
+from math import cos, sin, radians
+from collections import deque
+
+from . import Config
+from . import Command
+
+
+def lerp_angle(a0, a1, ratio):
+    """
+    Interpolates between two angles (in degree), along the shortest path.
+    """
+    delta = (a1 - a0 + 180) % 360 - 180
+    return a0 + delta * ratio
+
+
+def lerp_coordinate(c0, c1, size, ratio):
+    """
+    Interpolates between two coordinates wrapped around the screen (of the given size),
+    along the shortest path: a tank driving through an edge comes out on the other side.
+    """
+    delta = (c1 - c0 + size / 2) % size - size / 2
+    return c0 + delta * ratio
+
+
+class JitterBuffer:
+    """
+    The commands received for a remote tank, timestamped at reception.
+    The tank is displayed Config.remoteDelay seconds in the past: its state is
+    interpolated between the two states received around that time or, when no
+    newer state arrived yet, extrapolated from its last angle and speed.
+    Events (fire, destroyed, etc.) are applied once, in order, when due.
+    """
+
+    def __init__(self, delay=None, size=None):
+        self.delay = delay if delay is not None else Config.remoteDelay
+        # The (time, command) carrying a position, oldest first
+        self.states = deque(maxlen=size or Config.remoteBufferSize)
+        # The (time, command) carrying an event, oldest first
+        self.events = deque()
+
+    def __len__(self):
+        return len(self.states) + len(self.events)
+
+    def push(self, cmd, now):
+        """
+        Stores a command received at time 'now'.
+        """
+        if cmd.position is not None:
+            self.states.append((now, cmd))
+        if cmd.is_critical():
+            self.events.append((now, cmd))
+
+    def command(self, now):
+        """
+        Returns the command to execute to display the tank at time 'now', or None.
+        """
+        t = now - self.delay
+        # Only keep the last state before t and the next ones
+        states = self.states
+        while len(states) >= 2 and states[1][0] <= t:
+            states.popleft()
+        # Apply at most one event per frame
+        event = None
+        if self.events and self.events[0][0] <= t:
+            event = self.events.popleft()[1]
+            # A destroyed tank stays where it is
+            if event.state == Command.States.destroyed:
+                while states and states[0][0] <= t:
+                    states.popleft()
+        cmd = self.state(t)
+        if cmd is None:
+            return event
+        if event is not None:
+            cmd.state, cmd.fire, cmd.touchedby = event.state, event.fire, event.touchedby
+            if event.speed is not None:
+                cmd.speed = event.speed
+        return cmd
+
+    def state(self, t):
+        """
+        Returns a command with the state of the tank at time t, or None.
+        """
+        if not self.states or self.states[0][0] > t:
+            return None
+        t0, s0 = self.states[0]
+        # Interpolate between the states received around t
+        if len(self.states) >= 2:
+            t1, s1 = self.states[1]
+            ratio = (t - t0) / (t1 - t0) if t1 > t0 else 1
+            x = lerp_coordinate(s0.position[0], s1.position[0], Config.screen[0], ratio)
+            y = lerp_coordinate(s0.position[1], s1.position[1], Config.screen[1], ratio)
+            angle = lerp_angle(s0.angle, s1.angle, ratio)
+            turretangle = lerp_angle(s0.turretangle, s1.turretangle, ratio)
+            speed = s1.speed
+        # Or extrapolate from the last one
+        else:
+            frames = min(t - t0, Config.remoteMaxExtrapolation) * Config.fps
+            angle, speed, turretangle = s0.angle, s0.speed, s0.turretangle
+            x = s0.position[0] + speed * frames * cos(radians(angle))
+            y = s0.position[1] - speed * frames * sin(radians(angle))
+        # The command wraps the position around the screen
+        return Command(tankid=s0.tankid, angle=int(round(angle)), speed=speed,
+                       position=(int(round(x)), int(round(y))),
+                       turretangle=int(round(turretangle)))
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+
+"""
+Load generator for the server: synthetic bots streaming commands.
+Usage:
+
+    python3 -m coronatank.loadgen --server <ip:port> [--bots 200] [--rate 50] [--duration 30]
+
+Each bot connects, does the init handshake, then drives in circles, rotates its
+turret and fires from time to time. Bots run in the same process, so the time
+a message was sent is known when another bot receives it: the end-to-end relay
+latency percentiles and the message rates are printed periodically.
+"""
+
+from os import environ
+environ['PYGAME_HIDE_SUPPORT_PROMPT'] = '1'
+
+import time
+import random
+import asyncio
+import argparse
+
+from math import cos, sin, radians
+
+from . import Config
+from . import Command
+from .codec import Codecs, Compact, Legacy
+from .framing import Framer
+
+
+class Stats:
+    """
+    The counters and latencies shared by all the bots.
+    """
+
+    def __init__(self):
+        self.connected = 0
+        self.sent = 0
+        self.received = 0
+        self.latencies = []
+        # The time each message was sent, by (room, tank ID, turret angle)
+        self.sendTimes = {}
+
+    def percentiles(self):
+        latencies = sorted(self.latencies)
+        if not latencies:
+            return None
+        return [latencies[min(len(latencies)-1, int(p * len(latencies)))] for p in (0.5, 0.9, 0.99, 1)]
+
+
+class Bot:
+    """
+    A synthetic player, connected to the server over TCP.
+    The turret of the bot rotates by one degree per message, so that
+    (room, tank ID, turret angle) identifies a message for a few seconds.
+    """
+
+    def __init__(self, stats, rate, fire, codec):
+        self.stats = stats
+        self.period = 1 / rate
+        self.fire = fire
+        self.requestedCodec = codec
+        self.codec = Legacy
+        self.framer = Framer()
+        self.tankid = None
+        self.room = None
+        self.position = (random.randint(0, Config.screen[0]), random.randint(0, Config.screen[1]))
+        self.angle = random.randint(0, 359)
+        self.turretangle = 0
+        self.reader = None
+        self.writer = None
+
+    async def run(self, ip, port, until):
+        self.reader, self.writer = await asyncio.open_connection(ip, port)
+        await self.handshake()
+        self.stats.connected += 1
+        receiver = asyncio.ensure_future(self.receive())
+        try:
+            await self.send(until)
+        finally:
+            receiver.cancel()
+            self.writer.close()
+            self.stats.connected -= 1
+
+    async def handshake(self):
+        """
+        Sends the init request and reads the ID, room and codec assigned by the server.
+        """
+        self.writer.write(Command(state=Command.States.init, codec=self.requestedCodec._id).encode())
+        cmd = Command().decode(await self.reader.readexactly(Command.Msglen))
+        self.tankid, self.room = cmd.tankid, cmd.room
+        self.codec = Codecs.get(cmd.codec, Legacy)
+        self.framer.codec = self.codec
+
+    async def send(self, until):
+        """
+        Streams commands at the configured rate until the given time.
+        """
+        loop = asyncio.get_running_loop()
+        nextsend = loop.time()
+        while loop.time() < until:
+            self.writer.write(self.codec.pack(self.next_command().fields()))
+            self.stats.sent += 1
+            nextsend += self.period
+            await asyncio.sleep(max(0, nextsend - loop.time()))
+
+    def next_command(self):
+        """
+        Moves the bot and returns its command.
+        """
+        self.angle = (self.angle + Config.tankDeltaAngle // 2) % 360
+        self.turretangle = (self.turretangle + 1) % 360
+        speed = Config.tankMaxSpeed // 2
+        x, y = self.position
+        self.position = (int(x + speed * cos(radians(self.angle))) % Config.screen[0],
+                         int(y - speed * sin(radians(self.angle))) % Config.screen[1])
+        fire = random.randint(0, Config.maxInt) if random.random() < self.fire else None
+        self.stats.sendTimes[(self.room, self.tankid, self.turretangle)] = time.perf_counter()
+        return Command(tankid=self.tankid, angle=self.angle, speed=speed, position=self.position,
+                       turretangle=self.turretangle, fire=fire)
+
+    async def receive(self):
+        """
+        Reads the commands relayed by the server and measures their latency.
+        """
+        while True:
+            data = await self.reader.read(65536)
+            if not data:
+                return
+            now = time.perf_counter()
+            for cmd in self.framer.commands(self.framer.feed(data)):
+                self.stats.received += 1
+                sent = self.stats.sendTimes.get((self.room, cmd.tankid, cmd.turretangle))
+                if sent is not None:
+                    self.stats.latencies.append(now - sent)
+
+
+async def report(stats, period):
+    """
+    Prints the rates and latencies every period seconds.
+    """
+    sent, received = 0, 0
+    while True:
+        await asyncio.sleep(period)
+        percentiles = stats.percentiles()
+        latency = "-"
+        if percentiles is not None:
+            latency = "p50 {:.1f}ms p90 {:.1f}ms p99 {:.1f}ms max {:.1f}ms".format(
+                *(1000 * p for p in percentiles))
+        print("{} bots, sent {:.0f} msg/s, received {:.0f} msg/s, latency {}".format(
+            stats.connected, (stats.sent - sent) / period, (stats.received - received) / period, latency))
+        sent, received = stats.sent, stats.received
+        stats.latencies = []
+
+
+async def runloadgen():
+
+    # Parsing command line
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--server", help="IP:port of the server", required=True)
+    parser.add_argument("--bots", type=int, default=100, help="number of bots")
+    parser.add_argument("--rate", type=float, default=Config.fps, help="commands sent per second by each bot")
+    parser.add_argument("--fire", type=float, default=0.02, help="probability of firing with each command")
+    parser.add_argument("--duration", type=float, default=30, help="duration of the test, in seconds")
+    parser.add_argument("--legacy", action="store_true", help="use the legacy codec")
+    args = parser.parse_args()
+    ip, port = args.server.split(":")
+    port = int(port)
+
+    # Launch bots, staggered over the first second
+    loop = asyncio.get_running_loop()
+    stats = Stats()
+    until = loop.time() + args.duration
+    reporter = asyncio.ensure_future(report(stats, 1))
+    codec = Legacy if args.legacy else Compact
+    bots = []
+    for i in range(args.bots):
+        bots.append(asyncio.ensure_future(Bot(stats, args.rate, args.fire, codec).run(ip, port, until)))
+        await asyncio.sleep(1 / args.bots)
+    results = await asyncio.gather(*bots, return_exceptions=True)
+    reporter.cancel()
+    errors = [r for r in results if isinstance(r, Exception)]
+    if errors:
+        print("{} bots failed, e.g.: {!r}".format(len(errors), errors[0]))
+
+
+def loadgen():
+    asyncio.run(runloadgen())
+
+
+if __name__ == '__main__':
+    loadgen()
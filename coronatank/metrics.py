@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+
+"""
+This file contains the runtime metrics and the profiler of the server.
+"""
+
+import io
+import time
+import pstats
+import asyncio
+import cProfile
+
+
+class Histogram:
+    """
+    A histogram with fixed buckets, as Prometheus ones.
+    """
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0
+        self.max = 0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+        for i, bucket in enumerate(self.buckets):
+            if value <= bucket:
+                self.counts[i] += 1
+                break
+
+    def mean(self):
+        return self.sum / self.count if self.count else 0
+
+    def lines(self, name):
+        """
+        Returns the lines of the Prometheus text format describing the histogram.
+        """
+        lines = ["# TYPE {} histogram".format(name)]
+        cumulated = 0
+        for bucket, count in zip(self.buckets, self.counts):
+            cumulated += count
+            lines.append('{}_bucket{{le="{}"}} {}'.format(name, bucket, cumulated))
+        lines.append('{}_bucket{{le="+Inf"}} {}'.format(name, self.count))
+        lines.append("{}_sum {}".format(name, self.sum))
+        lines.append("{}_count {}".format(name, self.count))
+        return lines
+
+
+class Metrics:
+    """
+    The global counters of the server and the histograms of the event loop lag
+    and of the time spent forwarding messages.
+    Counters of each connection are kept by the connection itself.
+    """
+
+    Buckets = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1)
+
+    def __init__(self):
+        self.start = time.time()
+        self.connections = 0
+        self.messagesReceived = 0
+        self.messagesSent = 0
+        self.bytesReceived = 0
+        self.bytesSent = 0
+        self.dropped = 0
+        self.throttled = 0
+        self.invalid = 0
+        self.slowDisconnects = 0
+        self.loopLag = Histogram(self.Buckets)
+        self.fanout = Histogram(self.Buckets)
+
+    def lines(self):
+        """
+        Returns the lines of the Prometheus text format describing the metrics.
+        """
+        lines = []
+        for name, kind, value in (("connections", "gauge", self.connections),
+                                  ("messages_received_total", "counter", self.messagesReceived),
+                                  ("messages_sent_total", "counter", self.messagesSent),
+                                  ("bytes_received_total", "counter", self.bytesReceived),
+                                  ("bytes_sent_total", "counter", self.bytesSent),
+                                  ("messages_dropped_total", "counter", self.dropped),
+                                  ("messages_throttled_total", "counter", self.throttled),
+                                  ("messages_invalid_total", "counter", self.invalid),
+                                  ("slow_disconnects_total", "counter", self.slowDisconnects),
+                                  ("uptime_seconds", "gauge", time.time() - self.start)):
+            lines.append("# TYPE coronatank_{} {}".format(name, kind))
+            lines.append("coronatank_{} {}".format(name, value))
+        lines += self.loopLag.lines("coronatank_loop_lag_seconds")
+        lines += self.fanout.lines("coronatank_fanout_seconds")
+        return lines
+
+    def summary(self):
+        """
+        Returns a one line summary of the metrics.
+        """
+        return ("{} connections, {} msg in, {} msg out, {} dropped, {} throttled, {} invalid, "
+                "loop lag {:.2f}ms (max {:.2f}ms), fan-out {:.3f}ms (max {:.3f}ms)").format(
+                    self.connections, self.messagesReceived, self.messagesSent, self.dropped,
+                    self.throttled, self.invalid,
+                    1000 * self.loopLag.mean(), 1000 * self.loopLag.max,
+                    1000 * self.fanout.mean(), 1000 * self.fanout.max)
+
+
+async def monitor_loop(histogram, interval=0.1):
+    """
+    Measures the lag of the event loop: how late a sleep of 'interval' wakes up.
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        histogram.observe(max(0, loop.time() - start - interval))
+
+
+async def dump_stats(metrics, period):
+    """
+    Prints a summary of the metrics every period seconds.
+    """
+    while True:
+        await asyncio.sleep(period)
+        print(metrics.summary())
+
+
+class Profiler:
+    """
+    Profiles the server with cProfile during a fixed window.
+    The statistics are saved to a file and the hot spots printed.
+    """
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.profile = None
+
+    def start(self, seconds=None):
+        if self.profile is not None:
+            return False
+        seconds = seconds or self.seconds
+        print("Profiling for {} seconds.".format(seconds))
+        self.profile = cProfile.Profile()
+        self.profile.enable()
+        asyncio.get_event_loop().call_later(seconds, self.stop)
+        return True
+
+    def stop(self):
+        self.profile.disable()
+        filename = "coronatank-{}.prof".format(time.strftime("%Y%m%d-%H%M%S"))
+        self.profile.dump_stats(filename)
+        out = io.StringIO()
+        pstats.Stats(self.profile, stream=out).sort_stats("cumulative").print_stats(20)
+        print("Profile saved to {}.".format(filename))
+        print(out.getvalue())
+        self.profile = None
+
+
+class MetricsProtocol(asyncio.Protocol):
+    """
+    A minimal HTTP endpoint:
+     - GET /metrics returns the metrics in the Prometheus text format,
+     - GET /profile?seconds=N starts the profiler.
+    """
+
+    def __init__(self, render, profiler):
+        self.render = render
+        self.profiler = profiler
+        self.buffer = b''
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def data_received(self, data):
+        self.buffer += data
+        if b'\r\n' not in self.buffer:
+            return
+        request = self.buffer.split(b'\r\n', 1)[0].decode('latin-1').split()
+        path = request[1] if len(request) > 1 else '/'
+        if path.startswith('/profile'):
+            seconds = None
+            if 'seconds=' in path:
+                try:
+                    seconds = float(path.split('seconds=', 1)[1].split('&')[0])
+                except ValueError:
+                    seconds = 0
+                if not 0 < seconds < float('inf'):
+                    self.respond("400 Bad Request", "seconds must be a positive number\n")
+                    return
+            started = self.profiler.start(seconds)
+            self.respond("200 OK", "started\n" if started else "already running\n")
+        elif path.startswith('/metrics'):
+            self.respond("200 OK", "\n".join(self.render()) + "\n")
+        else:
+            self.respond("404 Not Found", "not found\n")
+
+    def respond(self, status, body):
+        body = body.encode()
+        self.transport.write("HTTP/1.0 {}\r\nContent-Type: text/plain; version=0.0.4\r\n"
+                             "Content-Length: {}\r\n\r\n".format(status, len(body)).encode() + body)
+        self.transport.close()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+
+"""
+This file contains the navigation grid used by the bots to find their way
+around the walls.
+
+The battlefield is divided into cells, a cell being free if a tank centered in
+it cannot touch any wall. The path to a goal is given by a flow field: for each
+cell, the next cell on a shortest path to the goal. The flow field of a goal is
+computed once (a breadth first search over the grid), then shared by all the
+bots heading to it: finding the next step of a path is a lookup.
+"""
+
+import pygame
+import random
+
+from array import array
+from collections import deque
+
+from . import Config
+
+
+# The moves between neighbouring cells, diagonal moves last
+Moves = [(1, 0), (0, -1), (-1, 0), (0, 1), (1, -1), (-1, -1), (-1, 1), (1, 1)]
+
+
+class Navigation:
+    """
+    The navigation grid of a battlefield and the flow fields computed on it.
+    """
+
+    # The navigation grid of each battlefield, by walls
+    _Maps = {}
+
+    def __init__(self, walls, cellsize=None):
+        self.cellsize = size = cellsize or Config.navigationCellSize
+        self.width = -(-Config.screen[0] // size)
+        self.height = -(-Config.screen[1] // size)
+        # A tank centered in a cell covers its inner rect around the cell
+        innersize = min(Config.tankDimensions) - 2 * Config.wallThickness
+        wallrects = [wall.rect for wall in walls]
+        self.free = bytearray(self.width * self.height)
+        self.centers = []
+        for index in range(self.width * self.height):
+            cx, cy = index % self.width, index // self.width
+            area = pygame.Rect(cx * size - innersize // 2, cy * size - innersize // 2,
+                               size + innersize, size + innersize)
+            self.free[index] = area.collidelist(wallrects) == -1
+            self.centers.append((cx * size + size // 2, cy * size + size // 2))
+        self.freeCells = [index for index in range(len(self.free)) if self.free[index]]
+        self.neighbours = [self._neighbours(index) for index in range(len(self.free))]
+        # The flow field of each goal cell
+        self.fields = {}
+
+    @classmethod
+    def of(cls, walls):
+        """
+        Returns the navigation grid of the battlefield with the given walls,
+        built on first use only.
+        """
+        key = tuple(tuple(wall.rect) for wall in walls)
+        if key not in cls._Maps:
+            cls._Maps[key] = cls(walls)
+        return cls._Maps[key]
+
+    def _neighbours(self, index):
+        """
+        Returns the cells reachable in one move from a cell. A diagonal move
+        does not cut the corner of a cell which is not free.
+        """
+        cx, cy = index % self.width, index // self.width
+        cells = []
+        for dx, dy in Moves:
+            x, y = cx + dx, cy + dy
+            if not (0 <= x < self.width and 0 <= y < self.height):
+                continue
+            if dx and dy and not (self.free[cy * self.width + x] and self.free[y * self.width + cx]):
+                continue
+            cells.append(y * self.width + x)
+        return cells
+
+    def cell(self, position):
+        """
+        Returns the index of the cell of a position, clamped to the grid.
+        """
+        size = self.cellsize
+        cx = min(max(int(position[0]) // size, 0), self.width - 1)
+        cy = min(max(int(position[1]) // size, 0), self.height - 1)
+        return cy * self.width + cx
+
+    def field(self, goal):
+        """
+        Returns the flow field of a goal cell: the next cell towards the goal for
+        each cell, the cell itself for the goal and the cells which cannot reach it.
+        """
+        field = self.fields.get(goal)
+        if field is not None:
+            return field
+        field = array('H', range(len(self.free)))
+        reached = bytearray(len(self.free))
+        reached[goal] = 1
+        queue = deque([goal])
+        while queue:
+            index = queue.popleft()
+            # The cells which are not free lead out, but paths do not go through them
+            if not self.free[index] and index != goal:
+                continue
+            for neighbour in self.neighbours[index]:
+                if not reached[neighbour]:
+                    reached[neighbour] = 1
+                    field[neighbour] = index
+                    queue.append(neighbour)
+        self.fields[goal] = field
+        return field
+
+    def waypoint(self, position, goal):
+        """
+        Returns the point to head to from position to reach goal: the center
+        of the next cell of the path, or the goal itself once in its cell
+        (or if it cannot be reached).
+        """
+        start, end = self.cell(position), self.cell(goal)
+        step = self.field(end)[start]
+        if step == start:
+            return goal
+        return self.centers[step]
+
+    def random_position(self):
+        """
+        Returns the center of a random free cell.
+        """
+        return self.centers[random.choice(self.freeCells)]
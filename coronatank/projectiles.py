@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+
+"""
+This file contains an array-backed store of projectiles, based on NumPy.
+NumPy is optional: the game uses a plain dict of Amunition without it.
+"""
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from math import cos, sin, radians
+
+from . import Config
+from .resources import Amunition
+
+
+class StoredAmunition(Amunition):
+    """
+    A projectile of a ProjectileStore.
+    It reads and writes its state in the arrays of the store.
+    """
+
+    def __init__(self, store, _id):
+        self.store = store
+        self._id = _id
+
+    @property
+    def position(self):
+        row = self.store.index[self._id]
+        return (int(self.store.x[row]), int(self.store.y[row]))
+
+    @property
+    def state(self):
+        return self.States(self.store.state[self.store.index[self._id]])
+
+    @state.setter
+    def state(self, state):
+        self.store.state[self.store.index[self._id]] = state.value
+
+    @property
+    def tank(self):
+        return self.store.tanks[self.store.index[self._id]]
+
+    def update(self, events, pressed, projectiles, walls, tanks, client):
+        """
+        Projectiles are updated all at once by ProjectileStore.step.
+        """
+        pass
+
+
+class ProjectileStore:
+    """
+    The projectiles of the battlefield, stored as NumPy arrays (one per attribute)
+    so that they are all moved, checked against walls and culled in one vectorized step.
+    It behaves as the dict of Amunition by ID used elsewhere in the game.
+    """
+
+    Active = Amunition.States.active.value
+    Triggered = Amunition.States.triggered.value
+    Detonated = Amunition.States.detonated.value
+
+    def __init__(self, capacity=64):
+        if numpy is None:
+            raise RuntimeError("The projectile store requires NumPy.")
+        self.count = 0
+        self.ids = numpy.empty(capacity, dtype=numpy.int64)
+        self.x = numpy.empty(capacity, dtype=numpy.int64)
+        self.y = numpy.empty(capacity, dtype=numpy.int64)
+        self.dx = numpy.empty(capacity, dtype=numpy.int64)
+        self.dy = numpy.empty(capacity, dtype=numpy.int64)
+        self.state = numpy.empty(capacity, dtype=numpy.int8)
+        # The tank which fired each projectile
+        self.tanks = []
+        # The row of each projectile, by ID
+        self.index = {}
+        self._walls = None
+        self._bounds = None
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, _id):
+        return _id in self.index
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def __getitem__(self, _id):
+        if _id not in self.index:
+            raise KeyError(_id)
+        return StoredAmunition(self, _id)
+
+    def __setitem__(self, _id, projectile):
+        """
+        Stores a projectile, typically an Amunition fired by a turret.
+        """
+        if _id in self.index:
+            del(self[_id])
+        if self.count == len(self.ids):
+            self._grow()
+        row = self.count
+        self.ids[row] = _id
+        self.x[row], self.y[row] = projectile.position
+        # Speeds are truncated as in Amunition.update
+        self.dx[row] = int(projectile.speed * cos(radians(projectile.angle)))
+        self.dy[row] = int(projectile.speed * -sin(radians(projectile.angle)))
+        self.state[row] = projectile.state.value
+        self.tanks.append(projectile.tank)
+        self.index[_id] = row
+        self.count += 1
+
+    def __delitem__(self, _id):
+        keep = numpy.ones(self.count, dtype=bool)
+        keep[self.index[_id]] = False
+        self._compact(keep)
+
+    def keys(self):
+        return self.index.keys()
+
+    def values(self):
+        return [StoredAmunition(self, _id) for _id in self.index]
+
+    def items(self):
+        return [(_id, StoredAmunition(self, _id)) for _id in self.index]
+
+    def step(self, walls, count=None):
+        """
+        Moves the first 'count' projectiles (all by default), triggers the ones
+        which hit a wall and removes the ones which detonated or left the screen.
+        """
+        n = self.count
+        if n == 0:
+            return
+        x, y, state = self.x[:n], self.y[:n], self.state[:n]
+        alive = state != self.Detonated
+        # Triggered projectiles stay still until they detonate
+        moving = state == self.Active
+        if count is not None:
+            moving[count:] = False
+        x += self.dx[:n] * moving
+        y += self.dy[:n] * moving
+        # Detect collision with walls (as pygame.Rect.collidepoint)
+        left, top, right, bottom = self._wall_bounds(walls)
+        hit = ((x[:, None] >= left) & (x[:, None] < right) &
+               (y[:, None] >= top) & (y[:, None] < bottom)).any(axis=1)
+        state[hit & moving] = self.Triggered
+        # Remove projectiles which have detonated or left the screen
+        maxX, maxY = Config.screen
+        keep = alive & (x >= 0) & (x <= maxX) & (y >= 0) & (y <= maxY)
+        if not keep.all():
+            self._compact(keep)
+
+    def detonate(self):
+        """
+        Detonates the projectiles triggered during the previous tick.
+        """
+        state = self.state[:self.count]
+        state[state == self.Triggered] = self.Detonated
+
+    def _wall_bounds(self, walls):
+        """
+        Returns the arrays of the left, top, right and bottom of the walls' rects.
+        """
+        if walls is not self._walls:
+            self._walls = walls
+            rects = numpy.array([(w.rect.left, w.rect.top, w.rect.right, w.rect.bottom) for w in walls],
+                                dtype=numpy.int64).reshape(-1, 4)
+            self._bounds = tuple(rects.T)
+        return self._bounds
+
+    def _compact(self, keep):
+        """
+        Only keeps the rows of the projectiles where keep is True.
+        """
+        n = self.count
+        m = int(keep.sum())
+        for array in (self.ids, self.x, self.y, self.dx, self.dy, self.state):
+            array[:m] = array[:n][keep]
+        self.tanks = [tank for tank, kept in zip(self.tanks, keep.tolist()) if kept]
+        self.count = m
+        self.index = {_id: row for row, _id in enumerate(self.ids[:m].tolist())}
+
+    def _grow(self):
+        """
+        Doubles the capacity of the arrays.
+        """
+        for name in ('ids', 'x', 'y', 'dx', 'dy', 'state'):
+            array = getattr(self, name)
+            grown = numpy.empty(2 * len(array), dtype=array.dtype)
+            grown[:len(array)] = array
+            setattr(self, name, grown)
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+
+"""
+This file contains the recorder of the matches hosted by the server, and the
+reader of the recordings (see replay.py).
+
+A recording is an append-only file: a magic number followed by records.
+Each record is a header (the time the message was received, the connection,
+room and tank which sent it, its codec and its length) and the message as received.
+"""
+
+import mmap
+import time
+import struct
+import asyncio
+
+from array import array
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor
+
+from . import Command
+from .codec import Codecs
+
+
+Magic = b'CTREC\x01'
+Record = struct.Struct('<dIIiBB')
+
+
+class Recorder:
+    """
+    Appends the messages relayed by the server to a recording.
+    Records are buffered and written by a background thread,
+    so that the event loop never waits for the disk.
+    """
+
+    def __init__(self, path, buffersize=64*1024):
+        self.path = path
+        self.buffersize = buffersize
+        self.file = open(path, 'ab')
+        if self.file.tell() == 0:
+            self.file.write(Magic)
+        self.buffer = bytearray()
+        # A single thread keeps the writes in order
+        self.writer = ThreadPoolExecutor(max_workers=1)
+        self.records = 0
+
+    def record(self, connection, room, tankid, codec, message):
+        self.buffer += Record.pack(time.time(), connection, room, tankid, codec._id, len(message))
+        self.buffer += message
+        self.records += 1
+        if len(self.buffer) >= self.buffersize:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            data, self.buffer = bytes(self.buffer), bytearray()
+            self.writer.submit(self.file.write, data)
+            self.writer.submit(self.file.flush)
+
+    async def run(self, period=1):
+        """
+        Flushes the buffer every period seconds, so that quiet matches are recorded too.
+        """
+        while True:
+            await asyncio.sleep(period)
+            self.flush()
+
+    def close(self):
+        self.flush()
+        self.writer.submit(self.file.close)
+        self.writer.shutdown()
+
+
+class Recording:
+    """
+    A recording, memory-mapped so that long ones are not read into memory.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as file:
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.map[:len(Magic)] != Magic:
+            raise ValueError("{} is not a recording".format(path))
+        # The seek index: times and offsets of some records, in order
+        self.times = array('d')
+        self.offsets = array('Q')
+
+    def records(self, offset=None):
+        """
+        Yields (offset, time, connection, room, tankid, codec, message) for each
+        record from offset. The message is a view on the mapped file.
+        A record truncated by a crash of the server ends the recording.
+        """
+        data = memoryview(self.map)
+        offset = len(Magic) if offset is None else offset
+        end = len(data)
+        while offset + Record.size <= end:
+            receivedAt, connection, room, tankid, codec, length = Record.unpack_from(data, offset)
+            start = offset + Record.size
+            if start + length > end:
+                return
+            yield offset, receivedAt, connection, room, tankid, Codecs[codec], data[start:start+length]
+            offset = start + length
+
+    def commands(self, offset=None):
+        """
+        Yields (time, room, command) for each record from offset.
+        """
+        for _, receivedAt, _, room, _, codec, message in self.records(offset):
+            for _, fields in codec.unpack(message):
+                yield receivedAt, room, Command().decode_fields(fields)
+
+    def index_path(self):
+        return self.path + ".idx"
+
+    def build_index(self, period=1):
+        """
+        Indexes the first record of every period seconds, and saves the index.
+        """
+        self.times, self.offsets = array('d'), array('Q')
+        for offset, receivedAt, *_ in self.records():
+            if not self.times or receivedAt >= self.times[-1] + period:
+                self.times.append(receivedAt)
+                self.offsets.append(offset)
+        with open(self.index_path(), 'wb') as file:
+            file.write(struct.pack('<Q', len(self.times)))
+            self.times.tofile(file)
+            self.offsets.tofile(file)
+        return self
+
+    def load_index(self):
+        """
+        Loads the index saved by build_index. Returns False if there is none.
+        """
+        try:
+            with open(self.index_path(), 'rb') as file:
+                count, = struct.unpack('<Q', file.read(8))
+                self.times, self.offsets = array('d'), array('Q')
+                self.times.fromfile(file, count)
+                self.offsets.fromfile(file, count)
+        except (OSError, EOFError, struct.error):
+            return False
+        return True
+
+    def start(self):
+        """
+        Returns the time of the first record, None if the recording is empty.
+        """
+        for _, receivedAt, *_ in self.records():
+            return receivedAt
+        return None
+
+    def seek(self, at):
+        """
+        Returns the offset of an indexed record at most at seconds after the start.
+        """
+        if not self.times:
+            return None
+        i = bisect_right(self.times, self.times[0] + at) - 1
+        return self.offsets[max(i, 0)]
+
+    def close(self):
+        self.map.close()
@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+
+"""
+This file contains the relay of the spectators.
+
+A relay watches the rooms of an upstream server as a single spectator per room,
+and fans the updates out to its own spectators, so that large audiences do not
+slow the match server down. Late spectators get the last message of each tank,
+as from the server. A relay can itself be the upstream of other relays.
+"""
+
+from os import environ
+environ['PYGAME_HIDE_SUPPORT_PROMPT'] = '1'
+
+import asyncio
+import argparse
+
+from . import Command
+from .codec import Codecs, Compact, Legacy
+from .framing import Framer
+from .metrics import monitor_loop, dump_stats
+from .server import Message, TankServerProtocol, Stats
+
+
+# Store the rooms watched upstream, by room requested.
+Feeds = {}
+
+# The address of the upstream server.
+Upstream = None
+
+
+class Feed:
+    """
+    A room watched upstream, and its spectators.
+    """
+
+    def __init__(self, key):
+        # The room requested by the spectators, None for the first room upstream
+        self.key = key
+        self.roomid = key
+        # Store the protocol of each spectator, by serial number
+        self.spectators = {}
+        # Store the last message of each tank, for late spectators
+        self.lastMessages = {}
+        # The codec used upstream, known once the upstream accepted the feed
+        self.codec = None
+        self.upstream = None
+
+    async def subscribe(self):
+        """
+        Connects to the upstream server.
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.create_connection(lambda: UpstreamProtocol(self), *Upstream)
+        except OSError as exc:
+            print("Cannot watch room '{}' upstream: {}".format(self.roomid, exc))
+            self.close()
+
+    def join(self, spectator):
+        self.spectators[spectator.serial] = spectator
+        if self.codec is not None:
+            self.welcome(spectator)
+
+    def leave(self, spectator):
+        self.spectators.pop(spectator.serial, None)
+        if not self.spectators:
+            self.close()
+
+    def start(self, roomid, codec):
+        """
+        Called once the upstream accepted the feed.
+        """
+        self.roomid, self.codec = roomid, codec
+        print("Watching room '{}' upstream.".format(roomid))
+        for spectator in list(self.spectators.values()):
+            self.welcome(spectator)
+
+    def welcome(self, spectator):
+        """
+        Sends the room and the last message of each tank to a new spectator.
+        """
+        transport = spectator.transport
+        transport.write(Command(state=Command.States.init, room=self.roomid, codec=spectator.codec._id,
+                                spectator=True).encode())
+        for message in self.lastMessages.values():
+            transport.write(message.encode(spectator.codec))
+        spectator.welcomed = True
+
+    def publish(self, msg, fields):
+        """
+        Forwards a message received upstream to all the spectators.
+        """
+        Stats.messagesReceived += 1
+        tankid = fields[0]
+        message = Message(fields, self.codec, msg)
+        critical = Command.critical(fields)
+        if fields[1] == Command.States.left.value:
+            self.lastMessages.pop(tankid, None)
+        else:
+            self.lastMessages[tankid] = message
+        # As from the server, state updates are numbered (but never sent over UDP)
+        entries = [(tankid, message, None if critical else 0)]
+        for spectator in self.spectators.values():
+            if spectator.welcomed:
+                spectator.send(entries)
+
+    def close(self):
+        """
+        Stops watching the room, disconnects its spectators.
+        """
+        if Feeds.get(self.key) is self:
+            del(Feeds[self.key])
+        if self.upstream is not None:
+            self.upstream.close()
+        for spectator in list(self.spectators.values()):
+            spectator.transport.close()
+        self.spectators = {}
+
+
+class UpstreamProtocol(asyncio.Protocol):
+    """
+    The connection of a feed to the upstream server, as a spectator.
+    """
+
+    def __init__(self, feed):
+        self.feed = feed
+        self.framer = Framer()
+        self.transport = None
+        # The data received before the answer to the init request is complete
+        self.initial = b''
+
+    def connection_made(self, transport):
+        self.transport = transport
+        # All the spectators may have left meanwhile
+        if Feeds.get(self.feed.key) is not self.feed:
+            transport.close()
+            return
+        self.feed.upstream = transport
+        transport.write(Command(state=Command.States.init, room=self.feed.roomid, codec=Compact._id,
+                                spectator=True).encode())
+
+    def data_received(self, data):
+        Stats.bytesReceived += len(data)
+        # The answer to the init request uses the legacy codec, the next messages
+        # the codec it tells
+        if self.feed.codec is None:
+            self.initial += data
+            if len(self.initial) < Command.Msglen:
+                return
+            cmd = Command().decode(self.initial[:Command.Msglen])
+            self.framer.codec = Codecs.get(cmd.codec, Legacy)
+            self.feed.start(cmd.room, self.framer.codec)
+            data = self.initial[Command.Msglen:]
+        chunk = self.framer.feed(data)
+        for msg, fields in self.framer.messages(chunk):
+            self.feed.publish(msg, fields)
+
+    def connection_lost(self, exc):
+        print("Lost room '{}' upstream.".format(self.feed.roomid))
+        self.feed.upstream = None
+        self.feed.close()
+
+
+class SpectatorProtocol(TankServerProtocol):
+    """
+    A spectator of the relay. It is sent the updates as a spectator of the
+    server would, with the same handling of slow connections.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.spectator = True
+        self.welcomed = False
+        self.feed = None
+
+    def data_received(self, data):
+        self.bytesReceived += len(data)
+        Stats.bytesReceived += len(data)
+        chunk = self.framer.feed(data)
+        for msg, fields in self.framer.messages(chunk):
+            if self.feed is not None:
+                continue
+            cmd = Command().decode_fields(fields)
+            if cmd.state != Command.States.init:
+                continue
+            # Players must connect to the server itself
+            if not cmd.spectator:
+                print("{} is not a spectator".format(self.peer))
+                self.transport.close()
+                return
+            self.codec = Codecs.get(cmd.codec, Legacy)
+            if cmd.room not in Feeds:
+                Feeds[cmd.room] = Feed(cmd.room)
+                asyncio.get_event_loop().create_task(Feeds[cmd.room].subscribe())
+            self.feed = Feeds[cmd.room]
+            self.feed.join(self)
+            print("{} watches room '{}'".format(self.peer, cmd.room))
+
+    def connection_lost(self, exc):
+        print("Spectator {} disconnected.".format(self.peer))
+        Stats.connections -= 1
+        if self.congestionTimer is not None:
+            self.congestionTimer.cancel()
+        if self.feed is not None:
+            self.feed.leave(self)
+
+
+async def runrelay():
+    global Upstream
+
+    # Parsing command line
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--server", help="IP:port of the upstream server (or relay)", required=True)
+    parser.add_argument("--listen", help="IP:port of the relay", required=True)
+    parser.add_argument("--stats", type=float, default=0, help="print the metrics every STATS seconds")
+    args = parser.parse_args()
+    upstreamip, upstreamport = args.server.split(":")
+    Upstream = (upstreamip, int(upstreamport))
+    ip, port = args.listen.split(":")
+
+    # Launch relay
+    loop = asyncio.get_running_loop()
+    relay = await loop.create_server(lambda: SpectatorProtocol(), ip, int(port))
+    loop.create_task(monitor_loop(Stats.loopLag))
+    if args.stats > 0:
+        loop.create_task(dump_stats(Stats, args.stats))
+    async with relay:
+        await relay.serve_forever()
+
+
+def relay():
+    asyncio.run(runrelay())
+
+
+if __name__ == '__main__':
+    relay()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+
+"""
+This file contains the renderer drawing the battlefield on the screen.
+"""
+
+import pygame
+
+from . import Config
+
+
+class Renderer:
+    """
+    Draws the state of a simulation on the screen.
+    In dirty rects mode, the floor and the walls are drawn once on a background.
+    Each frame, only the areas drawn during this frame and the previous one are
+    restored and pushed to the display, unless they cover more than
+    Config.dirtyThreshold of the screen, in which case the whole screen is pushed.
+    Projectiles and explosions are pre-rendered sprites, drawn in a single Surface.blits.
+    """
+
+    def __init__(self, screen, simulation, dirty=False):
+        self.screen = screen
+        self.simulation = simulation
+        self.dirty = dirty
+        self.background = None
+        # The rects drawn during the previous frame
+        self.previous = []
+
+    def draw(self):
+        if self.dirty:
+            self.draw_dirty()
+        else:
+            self.draw_full()
+
+    def draw_full(self):
+        """
+        Redraws and pushes the whole screen.
+        """
+        self.screen.fill(Config.floorColor)
+        for wall in self.simulation.walls:
+            wall.draw(self.screen)
+        self.draw_objects()
+        pygame.display.update()
+
+    def draw_dirty(self):
+        """
+        Redraws and pushes the areas which changed since the previous frame.
+        """
+        if self.background is None:
+            self.background = pygame.Surface(self.screen.get_size()).convert()
+            self.background.fill(Config.floorColor)
+            for wall in self.simulation.walls:
+                wall.draw(self.background)
+            self.screen.blit(self.background, (0, 0))
+            pygame.display.update()
+        # Erase the objects drawn during the previous frame
+        for rect in self.previous:
+            self.screen.blit(self.background, rect, rect)
+        # Draw the objects
+        rects = self.draw_objects()
+        # Push the areas which changed
+        dirty = self.previous + rects
+        width, height = self.screen.get_size()
+        if sum(rect.width * rect.height for rect in dirty) > Config.dirtyThreshold * width * height:
+            pygame.display.update()
+        else:
+            pygame.display.update(dirty)
+        self.previous = rects
+
+    def draw_objects(self):
+        """
+        Draws the tanks and the projectiles, returns the rects drawn.
+        """
+        simulation = self.simulation
+        rects = [tank.draw(self.screen) for tank in simulation.tanks + simulation.remoteTanks]
+        blits = [projectile.blit() for projectile in simulation.projectiles.values()]
+        rects.extend(self.screen.blits([blit for blit in blits if blit is not None]))
+        return rects
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+
+"""
+This file contains the tool replaying the matches recorded by the server.
+The commands are executed by a headless simulation of each room, in real time
+or as fast as possible.
+"""
+
+from os import environ
+environ['PYGAME_HIDE_SUPPORT_PROMPT'] = '1'
+
+import time
+import argparse
+
+from . import Config
+from . import Command
+from . import Tank
+from . import Simulation
+from .recorder import Recording
+
+
+class Match:
+    """
+    The state of a recorded room: a headless simulation of its tanks.
+    """
+
+    def __init__(self, _id):
+        self._id = _id
+        self.simulation = Simulation().headless()
+        self.tanks = {}
+        self.commands = 0
+        self.fires = 0
+        self.destructions = 0
+
+    def advance(self, ticks):
+        """
+        Steps the simulation up to ticks.
+        """
+        while self.simulation.ticks < ticks:
+            self.simulation.step()
+
+    def execute(self, cmd):
+        self.commands += 1
+        if cmd.state == Command.States.left:
+            tank = self.tanks.pop(cmd.tankid, None)
+            if tank is not None:
+                self.simulation.tanks.remove(tank)
+            return
+        if cmd.tankid not in self.tanks:
+            self.tanks[cmd.tankid] = self.simulation.add_tank(Tank().init_from_id(cmd.tankid))
+        if cmd.fire is not None:
+            self.fires += 1
+        if cmd.state == Command.States.destroyed:
+            self.destructions += 1
+        self.tanks[cmd.tankid].execute(cmd, self.simulation.projectiles)
+
+    def __str__(self):
+        tanks = ", ".join("{} at {}".format(_id, tank.position) for _id, tank in sorted(self.tanks.items()))
+        return "Room {}: {} commands, {} fires, {} destructions, {} ticks, tanks: {}".format(
+            self._id, self.commands, self.fires, self.destructions, self.simulation.ticks, tanks or "none")
+
+
+def replay():
+
+    # Parsing command line
+    parser = argparse.ArgumentParser()
+    parser.add_argument("recording", help="file recorded by the server with --record")
+    parser.add_argument("--fast", action="store_true", help="replay as fast as possible")
+    parser.add_argument("--room", type=int, help="only replay this room")
+    parser.add_argument("--start", type=float, default=0, help="start at START seconds, using the index")
+    parser.add_argument("--index", action="store_true", help="(re)build the seek index of the recording")
+    args = parser.parse_args()
+
+    recording = Recording(args.recording)
+    if args.index:
+        start = time.perf_counter()
+        recording.build_index()
+        print("Indexed {} seconds in {:.3f}s.".format(len(recording.times), time.perf_counter() - start))
+    offset, begin = None, None
+    if args.start > 0:
+        if not recording.load_index():
+            recording.build_index()
+        offset = recording.seek(args.start)
+        begin = recording.times[0] + args.start if recording.times else None
+
+    matches = {}
+    origin = None
+    count = 0
+    start = time.perf_counter()
+    for receivedAt, room, cmd in recording.commands(offset):
+        if args.room is not None and room != args.room:
+            continue
+        # The index only gets close to the start
+        if begin is not None and receivedAt < begin:
+            continue
+        if origin is None:
+            origin = receivedAt
+        elapsed = receivedAt - origin
+        # In real time, wait for the command to be due
+        if not args.fast:
+            delay = elapsed - (time.perf_counter() - start)
+            if delay > 0:
+                time.sleep(delay)
+        if room not in matches:
+            matches[room] = Match(room)
+        match = matches[room]
+        match.advance(int(elapsed * Config.fps))
+        match.execute(cmd)
+        count += 1
+
+    duration = time.perf_counter() - start
+    span = receivedAt - origin if origin is not None else 0
+    print("Replayed {} commands ({:.1f}s of match) in {:.3f}s, {:.0f} commands/s.".format(
+        count, span, duration, count / duration if duration else 0))
+    for _, match in sorted(matches.items()):
+        print(match)
+
+
+if __name__ == '__main__':
+    replay()
@@ -8,12 +8,14 @@ import pygame
 import time
 import struct
 
-from math import cos, sin, sqrt, radians, copysign
+from math import cos, sin, sqrt, atan2, degrees, radians, copysign
 from enum import Enum
 from random import randint
 
 from . import Config
 from . import Command
+from .sprites import SpriteCache
+from .navigation import Navigation
 
 class Tank:
     """
@@ -21,6 +23,17 @@ class Tank:
     It requires a turret and a pilot.
     """
 
+    # The clock used to time the destruction of the tank, replaced by the simulation's one
+    # when running faster than real time.
+    clock = staticmethod(time.time)
+
+    # The spatial hash of the tanks and projectiles, maintained by the simulation.
+    # Without it, collisions are checked against all the objects.
+    grid = None
+
+    # The pre-rendered sprites of all the tanks
+    sprites = SpriteCache()
+
     def __init__(self, position=None, angle=None, color=None, turret=None, pilot=None):
         self._id = None
         if position:
@@ -57,6 +70,16 @@ class Tank:
     def draw(self, screen):
         """
         Draws the tank.
+        Returns the rect of the screen which was drawn, as all the draw methods.
+        """
+        surface, (centerX, centerY) = self.sprites.get(self)
+        x, y = self.position[0] - centerX, self.position[1] - centerY
+        # Display the tank
+        return screen.blit(surface, (x,y))
+
+    def render(self, angle, turretangle):
+        """
+        Returns the sprite of the tank, rotated by angle, its turret rotated by turretangle.
         """
         surface = pygame.Surface(Config.tankDimensions).convert_alpha()
         surface.fill((0,0,0,0))
@@ -70,13 +93,9 @@ class Tank:
                          pygame.Rect((0, 5*Config.tankDimensions[1]//6 + 1),
                                      Config.tankDimensions))
         # Draw the turret
-        self.turret.draw(surface)
+        self.turret.draw(surface, turretangle)
         # Rotate the tank
-        surface = pygame.transform.rotate(surface, self.angle)
-        centerX, centerY = surface.get_rect().center
-        x, y = self.position[0] - centerX, self.position[1] - centerY
-        # Display the tank
-        screen.blit(surface, (x,y))
+        return pygame.transform.rotate(surface, angle)
 
     def update(self, events, pressed, projectiles, walls, tanks, client):
         """
@@ -86,6 +105,12 @@ class Tank:
         cmd = self.pilot.update(self, events, pressed, projectiles, walls, client)
         if cmd is None:
             return
+        self.execute(cmd, projectiles)
+
+    def execute(self, cmd, projectiles):
+        """
+        Updates the state of the tank based on a command.
+        """
         assert(self._id == cmd.tankid)
         # Update the tank accordingly
         if cmd.state == Command.States.destroyed:
@@ -121,14 +146,34 @@ class Tank:
         Returns a projectile or None.
         """
         tankrect = self.get_avg_rect()
-        for projectile in projectiles.values():
-            # A tank cannot destroy itself
-            if projectile.tank == self:
+        if self.grid is None:
+            candidates = projectiles.values()
+        else:
+            candidates = [projectiles[_id] for _id in self.grid.projectiles_near(tankrect)
+                          if _id in projectiles]
+        for projectile in candidates:
+            # A tank cannot destroy itself, nor be hit by an explosion
+            if projectile.tank == self or projectile.state != Amunition.States.active:
                 continue
             if tankrect.collidepoint(projectile.position):
                 return projectile
         return None
 
+    def detect_overlap(self, position, tanks=()):
+        """
+        Detects overlaps with other tanks at position.
+        Uses the spatial hash if any, the given tanks otherwise.
+        """
+        tankrect = self.get_avg_rect(position)
+        if self.grid is not None:
+            # The other tanks may have moved since the grid was built
+            margin = 2 * Config.tankMaxSpeed
+            tanks = self.grid.tanks_near(tankrect.inflate(margin, margin))
+        for tank in tanks:
+            if tank is not self and tank.position is not None and tankrect.colliderect(tank.get_avg_rect()):
+                return True
+        return False
+
     def get_inner_rect(self, position=None):
         """
         Returns an inner rectangle of the tank to use for wall collision detection.
@@ -157,7 +202,7 @@ class Tank:
             self.speed = 0
             self.alivecolor = self.color
             self.color = (30, 30, 30)
-            self.destroyedUntil = time.time() + Config.tankDeathDuration
+            self.destroyedUntil = self.clock() + Config.tankDeathDuration
 
     def repair(self):
         """
@@ -185,15 +230,17 @@ class Turret:
         self.canonLen = min(Config.tankDimensions) // 2
         self.radius = self.canonLen // 2
 
-    def draw(self, surface):
+    def draw(self, surface, angle=None):
         """
-        Draws the turret.
+        Draws the turret, rotated by angle (its own by default).
         """
+        if angle is None:
+            angle = self.angle
         # Draw the turret
         pygame.draw.circle(surface, self.color, (self.centerX, self.centerY), self.radius)
         # Draw the canon
-        canonEndX = self.centerX + cos(radians(self.angle)) * self.canonLen
-        canonEndY = self.centerY - sin(radians(self.angle)) * self.canonLen
+        canonEndX = self.centerX + cos(radians(angle)) * self.canonLen
+        canonEndY = self.centerY - sin(radians(angle)) * self.canonLen
         pygame.draw.line(surface, self.color, (self.centerX, self.centerY), (canonEndX, canonEndY), 4)
 
     def fire(self, projectiles, projectileid):
@@ -215,6 +262,7 @@ class Amunition:
 
     States = Enum('States', 'active triggered detonated')
     _Counter = 1000 * randint(1, 1000)
+    _Sprites = {}
 
     def __init__(self, _id, position, angle, tank):
         self._id = _id
@@ -232,11 +280,35 @@ class Amunition:
         """
         Draws the projectile.
         """
+        blit = self.blit()
+        if blit is None:
+            return None
+        return screen.blit(*blit)
+
+    def blit(self):
+        """
+        Returns the (sprite, position) to blit to draw the projectile, or None.
+        Projectiles are drawn in batch with Surface.blits.
+        """
         if self.state == self.States.active:
-            pygame.draw.circle(screen, (0,0,0,255), self.position, 3)
+            radius = 3
         elif self.state == self.States.triggered:
-            pygame.draw.circle(screen, (0,0,0,255), self.position, 30)
-            self.state = self.state.detonated
+            radius = 30
+        else:
+            return None
+        x, y = self.position
+        return (self.sprite(radius), (x - radius, y - radius))
+
+    @classmethod
+    def sprite(cls, radius):
+        """
+        Returns the pre-rendered sprite of a projectile or explosion of the given radius.
+        """
+        if radius not in cls._Sprites:
+            surface = pygame.Surface((2*radius, 2*radius), pygame.SRCALPHA)
+            pygame.draw.circle(surface, (0,0,0,255), (radius, radius), radius)
+            cls._Sprites[radius] = surface
+        return cls._Sprites[radius]
 
     def update(self, events, pressed, projectiles, walls, tanks, client):
         """
@@ -248,6 +320,9 @@ class Amunition:
             self.angle = 180
             self.speed = 10
             return
+        # A triggered projectile stays still until it detonates (see Simulation.detonate)
+        if self.state == self.States.triggered:
+            return
         # Update position
         dx = int(self.speed * cos(radians(self.angle)))
         dy = int(self.speed * -sin(radians(self.angle)))
@@ -285,13 +360,13 @@ class Wall:
         """
         Draws the wall.
         """
-        pygame.draw.line(screen, Config.wallColor, self.beg, self.end, 4)
+        return pygame.draw.line(screen, Config.wallColor, self.beg, self.end, 4)
 
     def draw_rect(self, screen):
         """
         Draws the rectangle used for collision detection.
         """
-        pygame.draw.rect(screen, (0,0,0), self.rect, 1)
+        return pygame.draw.rect(screen, (0,0,0), self.rect, 1)
 
 
 
@@ -323,17 +398,10 @@ class Pilot:
         """
         Return a command to be executed by the local and remote tanks, None if nothing to do.
         """
-        # No move if the tank is destroyed
-        if tank.destroyedUntil:
-            if time.time() < tank.destroyedUntil:
-                return None
-            else:
-                return Command(tankid=tank._id, state=Command.States.operational)
-
-        # Detect collisions with projectiles
-        projectile = tank.detect_hit(projectiles)
-        if projectile is not None:
-            return Command(tankid=tank._id, speed=0, state=Command.States.destroyed, touchedby=projectile._id)
+        # No move if the tank is destroyed or hit
+        disabled, cmd = self.disabled(tank, projectiles)
+        if disabled:
+            return cmd
 
         # Compute new tank angle based on player's input
         rotation = Config.tankDeltaAngle * (pressed[self.left] - pressed[self.right])
@@ -350,21 +418,8 @@ class Pilot:
             newtankspeed = 0
         newtankspeed = int(newtankspeed)
 
-        # Compute move considering possible collision with walls
-        delta = newtankspeed
-        direction = copysign(1, delta)
-        while True:
-            # Compute tentative position
-            dx = delta * cos(radians(newtankangle))
-            dy = delta * -sin(radians(newtankangle))
-            x, y = tank.position
-            newtankposition = (int(x + dx), int(y + dy))
-            # Reduce move in case of collision
-            if tank.detect_collision(newtankposition, walls):
-                delta -= direction
-                newtankspeed = 0
-            else:
-                break
+        # Compute move considering possible collision with walls and other tanks
+        newtankposition, newtankspeed = self.move(tank, newtankangle, newtankspeed, walls)
 
         # Compute turret angle based on player's input
         rotation = Config.turretDeltaAngle * (pressed[self.turretLeft] - pressed[self.turretRight])
@@ -384,6 +439,132 @@ class Pilot:
         return Command(tankid=tank._id, angle=newtankangle, speed=newtankspeed,
                        position=newtankposition, turretangle=newturretangle, fire=fire)
 
+    def disabled(self, tank, projectiles):
+        """
+        Returns (True, command) if the tank cannot be driven: it is destroyed (the command
+        repairs it once it can be, None before) or it is hit. Returns (False, None) otherwise.
+        """
+        if tank.destroyedUntil:
+            if tank.clock() < tank.destroyedUntil:
+                return True, None
+            else:
+                return True, Command(tankid=tank._id, state=Command.States.operational)
+
+        # Detect collisions with projectiles
+        projectile = tank.detect_hit(projectiles)
+        if projectile is not None:
+            return True, Command(tankid=tank._id, speed=0, state=Command.States.destroyed,
+                                 touchedby=projectile._id)
+        return False, None
+
+    def move(self, tank, angle, speed, walls):
+        """
+        Returns the new position and speed of the tank moving at angle and speed,
+        the move being reduced in case of collision with walls and other tanks
+        (tanks which already overlap can move apart).
+        """
+        overlapping = tank.detect_overlap(tank.position)
+        delta = speed
+        direction = copysign(1, delta)
+        while True:
+            # Compute tentative position
+            dx = delta * cos(radians(angle))
+            dy = delta * -sin(radians(angle))
+            x, y = tank.position
+            position = (int(x + dx), int(y + dy))
+            # Reduce move in case of collision
+            if (tank.detect_collision(position, walls)
+                or (not overlapping and tank.detect_overlap(position))):
+                delta -= direction
+                speed = 0
+            else:
+                return position, speed
+
+
+class BotPilot(Pilot):
+    """
+    A pilot driven by the computer. It chases the closest tank in sight (or wanders
+    around), turns its turret to it and fires when aimed.
+    Paths come from the navigation grid shared by all the bots, so that a bot only
+    does a few lookups per tick. Unlike the others, a bot pilot drives a single tank.
+    """
+
+    def __init__(self, sight=None):
+        self.sight = sight or Config.botSight
+        self.navigation = None
+        # The tank chased, the point to wander to without any
+        self.target = None
+        self.goal = None
+        self.ticks = 0
+        self.nextFire = 0
+
+    def command(self, tank, events, pressed, projectiles, walls):
+        """
+        Return the command of the bot, None if nothing to do.
+        """
+        # No move if the tank is destroyed or hit
+        disabled, cmd = self.disabled(tank, projectiles)
+        if disabled:
+            return cmd
+        if self.navigation is None:
+            self.navigation = Navigation.of(walls)
+
+        # Look for the closest tank from time to time
+        if self.ticks % Config.botScanPeriod == 0:
+            self.target = self.scan(tank)
+        self.ticks += 1
+        if self.target is not None:
+            goal = self.target.position
+        else:
+            if self.goal is None or self.navigation.cell(tank.position) == self.navigation.cell(self.goal):
+                self.goal = self.navigation.random_position()
+            goal = self.goal
+
+        # Turn towards the next point of the path, slow down in the turns
+        # and stop close to the target
+        turn = difference(bearing(tank.position, self.navigation.waypoint(tank.position, goal)), tank.angle)
+        newtankangle = (tank.angle + max(-Config.tankDeltaAngle, min(Config.tankDeltaAngle, turn))) % 360
+        if self.target is not None and distance(tank.position, goal) < 2 * max(Config.tankDimensions):
+            speed = 0
+        elif abs(turn) > 45:
+            speed = 1
+        else:
+            speed = Config.tankMaxSpeed
+        # Accelerate and slow down progressively, as the players
+        newtankspeed = int(max(tank.speed - 1, min(tank.speed + 1, speed)))
+        newtankposition, newtankspeed = self.move(tank, newtankangle, newtankspeed, walls)
+
+        # Aim at the target and fire
+        newturretangle = tank.turret.angle
+        fire = None
+        if self.target is not None:
+            aim = difference(bearing(newtankposition, self.target.position) - newtankangle, newturretangle)
+            newturretangle = (newturretangle
+                              + max(-Config.turretDeltaAngle, min(Config.turretDeltaAngle, aim))) % 360
+            if abs(aim) <= Config.botAimTolerance and tank.clock() >= self.nextFire:
+                fire = Amunition.next_id()
+                self.nextFire = tank.clock() + Config.botFirePeriod
+
+        return Command(tankid=tank._id, angle=newtankangle, speed=newtankspeed,
+                       position=newtankposition, turretangle=newturretangle, fire=fire)
+
+    def scan(self, tank):
+        """
+        Returns the closest operational tank in sight, None if there is none.
+        Only the cells of the spatial hash in sight are looked at.
+        """
+        if tank.grid is None:
+            return None
+        sight = tank.get_avg_rect().inflate(2 * self.sight, 2 * self.sight)
+        closest, closestDistance = None, self.sight
+        for other in tank.grid.tanks_near(sight):
+            if other is tank or other.position is None or other.destroyedUntil is not None:
+                continue
+            d = distance(tank.position, other.position)
+            if d < closestDistance:
+                closest, closestDistance = other, d
+        return closest
+
 
 class RemotePilot:
     """
@@ -395,5 +576,25 @@ class RemotePilot:
         """
         Collects last command from the server and return it to the tank.
         """
+        if client is None:
+            return None
         cmd = client.recv_command(tank._id)
         return cmd
+
+
+def bearing(origin, point):
+    """
+    Returns the angle (in degrees) from origin to point.
+    """
+    return int(degrees(atan2(origin[1] - point[1], point[0] - origin[0])))
+
+
+def difference(angle, other):
+    """
+    Returns the rotation from other to angle, between -180 and 180 degrees.
+    """
+    return (angle - other + 180) % 360 - 180
+
+
+def distance(position, other):
+    return sqrt((position[0] - other[0]) ** 2 + (position[1] - other[1]) ** 2)
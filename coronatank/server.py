@@ -2,106 +2,728 @@
 
 """
 Basic tpc server that forward messages received from any client to all the others.
+Clients are grouped in rooms, each room being an independent match.
 """
 
 
 from os import environ
 environ['PYGAME_HIDE_SUPPORT_PROMPT'] = '1'
 
+import time
+import signal
+import itertools
 import asyncio
-import struct
 import argparse
 
+from . import Config
 from . import Command
+from .codec import Codecs, Compact, Legacy
+from .framing import Framer, ClientHeader, RecordHeader, Acknowledgement, is_newer
+from .metrics import Metrics, MetricsProtocol, Profiler, monitor_loop, dump_stats
+from .recorder import Recorder
+from .snapshot import World, Ack
 
 
-# Store the transport of each client.
-Clients = {}
+# Store the rooms (i.e. the independent matches) hosted by the server.
+Rooms = {}
 
-# Store the last message sent to each client.
-LastMessages = {}
+# Forward messages at each tick of the server instead of immediately.
+Coalesce = False
+
+# The transport of the UDP endpoint, if any.
+Datagrams = None
+
+# The number of commands each client may send per second, None for no limit.
+InboundRate = None
+
+# In a worker process, the channel to the supervisor (see supervisor.py).
+Channel = None
+
+# The recorder of the messages relayed, if any.
+Journal = None
+
+# The serial numbers of the connections, as recorded.
+Serials = itertools.count()
+
+# The runtime metrics of the server.
+Stats = Metrics()
+
+# The states of the commands relayed for the players: none, or an event of their tank.
+# The other ones are only sent by the server.
+Relayed = {-1, Command.States.operational.value, Command.States.destroyed.value}
+
+
+class Message:
+    """
+    A message relayed by the server.
+    It is encoded once per codec used by the clients, when first needed.
+    """
+
+    __slots__ = ('fields', 'encoded')
+
+    def __init__(self, fields, codec=Legacy, data=None):
+        self.fields = fields
+        self.encoded = {}
+        if data is not None:
+            self.encoded[codec] = data
+
+    def encode(self, codec):
+        if codec not in self.encoded:
+            self.encoded[codec] = codec.pack(self.fields)
+        return self.encoded[codec]
+
+
+class Room:
+    """
+    A match hosted by the server.
+    Each room has its own clients and only forwards messages between them.
+    """
+
+    def __init__(self, _id):
+        self._id = _id
+        # Store the protocol of each client.
+        self.clients = {}
+        # Store the protocol of each spectator, by serial number. They take no seat.
+        self.spectators = {}
+        # Store the last message sent by each client.
+        self.lastMessages = {}
+        # Store the (sender, message, sequence) to forward at next tick.
+        # Superseded state updates are replaced by None to keep the order of the others.
+        self.pending = []
+        # Store the index in 'pending' of the last state update of each client.
+        self.pendingStates = {}
+        # The state of the tanks, sent as snapshots to the clients which requested them
+        self.world = World()
+
+    def is_full(self):
+        return len(self.clients) >= Config.roomCapacity
+
+    def join(self, protocol):
+        """
+        Adds a new client to the room and returns its ID.
+        """
+        _id = min(range(len(self.clients)+1) - self.clients.keys())
+        self.clients[_id] = protocol
+        return _id
+
+    def leave(self, _id):
+        """
+        Removes a client from the room.
+        """
+        if _id in self.clients.keys():
+            del(self.clients[_id])
+        if _id in self.lastMessages.keys():
+            del(self.lastMessages[_id])
+
+    def is_empty(self):
+        return not self.clients and not self.spectators
+
+    def broadcast(self, senderid, message, critical=True):
+        """
+        Sends a message to all the clients of the room but the sender.
+        In coalesce mode, the message is queued until next tick and, if not critical,
+        replaces the previous state update of the same sender.
+        State updates are numbered so that they can be sent over UDP.
+        """
+        sequence = None
+        if not critical:
+            sender = self.clients[senderid]
+            sender.sequence += 1
+            sequence = sender.sequence
+        if not Coalesce:
+            start = time.perf_counter()
+            # The clients receiving snapshots only get the events
+            for _id, client in self.clients.items():
+                if _id != senderid and (critical or not client.snapshots):
+                    client.send([(senderid, message, sequence)])
+            for spectator in self.spectators.values():
+                if critical or not spectator.snapshots:
+                    spectator.send([(senderid, message, sequence)])
+            Stats.fanout.observe(time.perf_counter() - start)
+            return
+        if not critical:
+            if senderid in self.pendingStates:
+                self.pending[self.pendingStates[senderid]] = None
+            self.pendingStates[senderid] = len(self.pending)
+        self.pending.append((senderid, message, sequence))
+
+    def flush(self):
+        """
+        Sends the messages queued since last tick, in one write per client.
+        """
+        if not self.pending:
+            return
+        start = time.perf_counter()
+        for _id, client in self.clients.items():
+            client.send([entry for entry in filter(None, self.pending)
+                         if entry[0] != _id and (entry[2] is None or not client.snapshots)])
+        if self.spectators:
+            entries = list(filter(None, self.pending))
+            events = [entry for entry in entries if entry[2] is None]
+            for spectator in self.spectators.values():
+                spectator.send(events if spectator.snapshots else entries)
+        Stats.fanout.observe(time.perf_counter() - start)
+        self.pending = []
+        self.pendingStates = {}
+
+    def publish(self):
+        """
+        Sends the last snapshot of the room to the clients which requested snapshots,
+        as a delta of the last one each of them acknowledged.
+        The deltas are only encoded once for the clients sharing the same baseline.
+        """
+        receivers = [client for client in self.clients.values() if client.snapshots]
+        receivers += [spectator for spectator in self.spectators.values() if spectator.snapshots]
+        if not receivers:
+            return
+        number = self.world.snapshot()
+        deltas = {}
+        for client in receivers:
+            if client.acked == number:
+                continue
+            key = (client.acked, client.codec)
+            if key not in deltas:
+                deltas[key] = b''.join(client.codec.pack(fields) for fields in self.world.delta(client.acked))
+            client.send_snapshot(deltas[key])
+
+
+def watch_room(roomid=None):
+    """
+    Returns the room requested by a spectator, creating it if needed.
+    If no room is requested, returns the first one.
+    Returns None if the requested room does not exist (a negative ID).
+    """
+    global Rooms
+    if roomid is None:
+        roomid = min(Rooms.keys(), default=0)
+    if roomid < 0:
+        return None
+    if roomid not in Rooms:
+        Rooms[roomid] = Room(roomid)
+    return Rooms[roomid]
+
+
+def find_room(roomid=None):
+    """
+    Returns the room requested by a client, creating it if needed.
+    If no room is requested, returns the first one with a free seat.
+    Returns None if the requested room is full or does not exist (a negative ID).
+    """
+    global Rooms
+    if roomid is None:
+        for room in Rooms.values():
+            if not room.is_full():
+                return room
+        roomid = min(range(len(Rooms)+1) - Rooms.keys())
+    if roomid < 0:
+        return None
+    if roomid not in Rooms:
+        Rooms[roomid] = Room(roomid)
+    room = Rooms[roomid]
+    if room.is_full():
+        return None
+    return room
+
+
+def notify(event, roomid):
+    """
+    Tells the supervisor, if any, about an event of a room.
+    """
+    if Channel is not None:
+        Channel.send("{} {}".format(event, roomid).encode())
 
 
 class TankServerProtocol(asyncio.Protocol):
 
-    def __init__(self):
-        self.buffer = b''
+    def __init__(self, initial=b''):
+        # The data already received by the supervisor, if any
+        self.initial = initial
+        self.serial = next(Serials)
+        self.framer = Framer()
+        self.codec = Legacy
         self._id = None
+        self.room = None
+        # A spectator receives the updates of its room but never sends any
+        self.spectator = False
+        # A client receiving snapshots instead of state updates, and the last one it acknowledged
+        self.snapshots = False
+        self.acked = None
         self.transport = None
+        self.peer = None
+        # The UDP address of the client, once registered
+        self.udpAddress = None
+        # The sequence number of the last state update received over UDP
+        self.udpSequence = None
+        # The sequence number of the last state update relayed
+        self.sequence = 0
+        # When the write buffer of the client is full, the last state update of
+        # each tank, sent once it drained, and the timer to disconnect the client
+        self.congested = False
+        self.backlog = {}
+        self.congestionTimer = None
+        # The token bucket limiting the commands received from the client, full at first
+        self.tokens = InboundRate * Config.inboundBurst if InboundRate is not None else 0
+        self.refilled = time.monotonic()
+        # Counters of the connection
+        self.messagesReceived = 0
+        self.messagesSent = 0
+        self.bytesReceived = 0
+        self.bytesSent = 0
+        self.throttled = 0
+        self.invalid = 0
 
     def connection_made(self, transport):
         """
         Accept cxn of new client, assign them an ID.
         """
-        print('New connection from {}'.format(transport.get_extra_info('peername')))
+        self.peer = transport.get_extra_info('peername')
+        print('New connection from {}'.format(self.peer))
         self.transport = transport
+        transport.set_write_buffer_limits(Config.clientHighWater, Config.clientLowWater)
+        Stats.connections += 1
+        if self.initial:
+            self.data_received(self.initial)
 
-    def data_received(self, data):
+    def send(self, entries):
         """
-        Receive message from one client and forward to all others.
+        Sends a list of (sender, message, sequence) to the client.
+        If the client registered a UDP address, state updates are sent in a
+        single datagram and events over TCP. Otherwise, all go over TCP.
         """
-        global Clients, LastMessages
-        self.buffer += data
-        while len(self.buffer) >= Command.Msglen:
+        if self.congested:
+            entries = self.hold(entries)
+        if self.udpAddress is None:
+            data = b''.join(message.encode(self.codec) for _, message, _ in entries)
+        else:
+            data = b''.join(message.encode(self.codec)
+                            for _, message, sequence in entries if sequence is None)
+            datagram = b''.join(RecordHeader.pack(senderid, sequence) + message.encode(self.codec)
+                                for senderid, message, sequence in entries if sequence is not None)
+            if datagram:
+                Datagrams.sendto(datagram, self.udpAddress)
+                self.bytesSent += len(datagram)
+                Stats.bytesSent += len(datagram)
+        if data:
+            self.transport.write(data)
+            self.bytesSent += len(data)
+            Stats.bytesSent += len(data)
+        self.messagesSent += len(entries)
+        Stats.messagesSent += len(entries)
 
-            # Read next message
-            msg = self.buffer[:Command.Msglen]
-            self.buffer = self.buffer[Command.Msglen:]
+    def send_snapshot(self, data):
+        """
+        Sends an encoded snapshot to the client.
+        A congested client is skipped: it will get a delta of the last snapshot
+        it acknowledged once it drained.
+        """
+        if self.congested:
+            return
+        self.transport.write(data)
+        self.bytesSent += len(data)
+        Stats.bytesSent += len(data)
+        self.messagesSent += 1
+        Stats.messagesSent += 1
+
+    def hold(self, entries):
+        """
+        Returns the entries to send to a congested client.
+        State updates sent over TCP are held back, only the last one of each tank
+        being kept. Events are sent right away, after the state held for their sender.
+        """
+        tosend = []
+        for entry in entries:
+            senderid, _, sequence = entry
+            if sequence is None:
+                if senderid in self.backlog:
+                    tosend.append(self.backlog.pop(senderid))
+                tosend.append(entry)
+            elif self.udpAddress is not None:
+                tosend.append(entry)
+            else:
+                if senderid in self.backlog:
+                    Stats.dropped += 1
+                self.backlog[senderid] = entry
+        return tosend
+
+    def pause_writing(self):
+        """
+        Called when the write buffer of the client goes above the high mark.
+        The client stops being read until it drains: it cannot get the answers anyway.
+        """
+        print("Client '{}' is congested.".format(self._id))
+        self.congested = True
+        self.transport.pause_reading()
+        self.congestionTimer = asyncio.get_event_loop().call_later(Config.clientMaxCongestion,
+                                                                   self.disconnect_slow)
+
+    def resume_writing(self):
+        """
+        Called when the write buffer of the client goes below the low mark.
+        Sends the last state of each tank held meanwhile.
+        """
+        self.congested = False
+        self.congestionTimer.cancel()
+        self.congestionTimer = None
+        backlog, self.backlog = list(self.backlog.values()), {}
+        if backlog:
+            self.send(backlog)
+        # Sending the backlog may have filled the buffer again
+        if not self.congested and not self.transport.is_closing():
+            self.transport.resume_reading()
+
+    def disconnect_slow(self):
+        """
+        Disconnects a client congested for too long.
+        """
+        print("Client '{}' congested for too long, disconnecting it.".format(self._id))
+        Stats.slowDisconnects += 1
+        self.transport.abort()
+
+    def data_received(self, data):
+        """
+        Receive message from one client and forward to all others in its room.
+        """
+        self.bytesReceived += len(data)
+        Stats.bytesReceived += len(data)
+        self.refill()
+        chunk = self.framer.feed(data)
+        for msg, fields in self.framer.messages(chunk):
 
             # The first message received should be an init request
-            if self._id is None and Command().decode(msg).state == Command.States.init:
+            if self.room is None:
+                cmd = Command().decode_fields(fields)
+                if cmd.state != Command.States.init:
+                    continue
+                if cmd.spectator:
+                    self.watch(cmd)
+                    continue
+                # Find the room requested by the client
+                room = find_room(cmd.room)
+                if room is None:
+                    print("{} requested full or invalid room '{}'".format(
+                        self.transport.get_extra_info('peername'), cmd.room))
+                    notify("leave", cmd.room)
+                    self.transport.close()
+                    return
                 # Determine the ID of the newly connected client
-                self._id = min(range(len(Clients)+1) - Clients.keys())
-                Clients[self._id] = self.transport
-                print("{} got assigned ID '{}'".format(self.transport.get_extra_info('peername'),
-                                                     self._id))
-                # Communicate ID to the newly connected tank.
-                self.transport.write(Command(tankid=self._id).encode())
+                self.room = room
+                self._id = room.join(self)
+                print("{} got assigned ID '{}' in room '{}'".format(self.transport.get_extra_info('peername'),
+                                                                  self._id, room._id))
+                # Communicate ID, room and codec to the newly connected tank.
+                # Old clients do not request any codec and keep using the legacy one.
+                self.codec = Codecs.get(cmd.codec, Legacy)
+                self.snapshots = cmd.snapshots
+                self.transport.write(Command(tankid=self._id, state=Command.States.init,
+                                             room=room._id, codec=self.codec._id,
+                                             snapshots=self.snapshots).encode())
+                self.framer.codec = self.codec
                 # Communicate positions of the other tanks to the newly connected tank.
-                for _id, msg in LastMessages.items():
-                    self.transport.write(msg)
+                self.welcome()
+
+            # Acknowledgements of snapshots
+            elif fields[1] == Ack:
+                self.acked = fields[7]
 
             # Later messages received are tank updates to transmit to all other tanks
-            else:
-                LastMessages[self._id] = msg
-                for _id, transport in Clients.items():
-                    if _id != self._id:
-                        transport.write(msg)
+            elif not self.spectator:
+                self.relay(msg, fields)
+
+    def watch(self, cmd):
+        """
+        Makes the client a spectator of the room it requested.
+        """
+        self.spectator = True
+        room = watch_room(cmd.room)
+        if room is None:
+            print("{} requested invalid room '{}'".format(self.transport.get_extra_info('peername'), cmd.room))
+            self.transport.close()
+            return
+        self.room = room
+        self.room.spectators[self.serial] = self
+        print("{} watches room '{}'".format(self.transport.get_extra_info('peername'), self.room._id))
+        self.codec = Codecs.get(cmd.codec, Legacy)
+        self.snapshots = cmd.snapshots
+        self.transport.write(Command(state=Command.States.init, room=self.room._id,
+                                     codec=self.codec._id, spectator=True,
+                                     snapshots=self.snapshots).encode())
+        self.framer.codec = self.codec
+        self.welcome()
+
+    def welcome(self):
+        """
+        Sends the state of the room to a new client: a keyframe of the last snapshot
+        if it requested snapshots, the last message of each tank otherwise.
+        """
+        if self.snapshots:
+            if self.room.world.history:
+                self.send_snapshot(b''.join(self.codec.pack(fields) for fields in self.room.world.delta()))
+            return
+        for _id, message in self.room.lastMessages.items():
+            self.transport.write(message.encode(self.codec))
+
+    def relay(self, msg, fields):
+        """
+        Forwards a tank update to all other tanks of the room.
+        The update is dropped if it is not about the tank of the client, if its
+        state is not one a player sends, if it cannot be sent with the compact
+        codec or if the client sends too many of them.
+        """
+        self.messagesReceived += 1
+        Stats.messagesReceived += 1
+        if fields[0] != self._id or fields[1] not in Relayed or not Compact.fits(fields):
+            self.invalid += 1
+            Stats.invalid += 1
+            return
+        critical = Command.critical(fields)
+        if not self.allow(critical):
+            self.throttled += 1
+            Stats.throttled += 1
+            return
+        if Journal is not None:
+            Journal.record(self.serial, self.room._id, self._id, self.codec, msg)
+        message = Message(fields, self.codec, msg)
+        self.room.lastMessages[self._id] = message
+        self.room.world.update(fields)
+        self.room.broadcast(self._id, message, critical)
+
+    def refill(self):
+        """
+        Adds the tokens earned since last refill to the bucket of the client.
+        """
+        if InboundRate is None:
+            return
+        now = time.monotonic()
+        self.tokens = min(InboundRate * Config.inboundBurst,
+                          self.tokens + InboundRate * (now - self.refilled))
+        self.refilled = now
+
+    def allow(self, critical):
+        """
+        Tells if the client can send one more command, and takes its token.
+        Once the bucket is empty, the state updates are dropped but the events
+        can still go into debt, up to a full burst.
+        """
+        if InboundRate is None:
+            return True
+        if self.tokens >= 1 or (critical and self.tokens >= 1 - InboundRate * Config.inboundBurst):
+            self.tokens -= 1
+            return True
+        return False
+
+    def datagram_received(self, data, addr, sequence):
+        """
+        Receives the payload of a datagram sent by the client.
+        An empty one registers the address of the client, other ones carry
+        a state update, dropped if older than the last one received.
+        """
+        if addr != self.udpAddress:
+            print("Client '{}' registered UDP address {}".format(self._id, addr))
+            self.udpAddress = addr
+        self.bytesReceived += len(data)
+        Stats.bytesReceived += len(data)
+        self.refill()
+        if not data:
+            Datagrams.sendto(Acknowledgement, addr)
+            return
+        if not is_newer(sequence, self.udpSequence):
+            Stats.dropped += 1
+            return
+        self.udpSequence = sequence
+        if self.codec.complete(data) != len(data):
+            return
+        for msg, fields in self.codec.unpack(memoryview(data)):
+            # Events must be sent over TCP
+            if not Command.critical(fields):
+                self.relay(msg, fields)
 
     def connection_lost(self, exc):
         """
         Remove the disconected client from the list of active clients.
         """
-        global Clients, LastMessages
+        global Rooms
         # The client disconnected, remove it from the list
-        print("Client '{}' disconnected.".format(self._id))
-        if self._id in Clients.keys():
-            del(Clients[self._id])
-        if self._id in LastMessages.keys():
-            del(LastMessages[self._id])
-        # Warn all the other clients
-        if self._id is not None:
-            msg = Command(tankid=self._id, state=Command.States.left).encode()
-            for _id, transport in Clients.items():
-                if _id != self._id:
-                    transport.write(msg)
+        if self.spectator:
+            print("Spectator {} disconnected.".format(self.peer))
+        else:
+            print("Client '{}' disconnected.".format(self._id))
+        Stats.connections -= 1
+        if self.congestionTimer is not None:
+            self.congestionTimer.cancel()
+        if self.room is None:
+            return
+        if self.spectator:
+            del(self.room.spectators[self.serial])
+        else:
+            self.leave()
+        # Close the room once empty
+        if self.room.is_empty() and Rooms.get(self.room._id) is self.room:
+            del(Rooms[self.room._id])
 
+    def leave(self):
+        """
+        Removes the tank of the client from its room.
+        """
+        notify("leave", self.room._id)
+        self.room.leave(self._id)
+        # Warn all the other clients of the room
+        message = Message(Command(tankid=self._id, state=Command.States.left).fields())
+        if Journal is not None:
+            Journal.record(self.serial, self.room._id, self._id, Legacy, message.encode(Legacy))
+        self.room.world.update(message.fields)
+        self.room.broadcast(self._id, message)
 
-async def runserver():
 
-    # Parsing command line
+class TankDatagramProtocol(asyncio.DatagramProtocol):
+    """
+    Receives the state updates sent by clients over UDP.
+    """
+
+    def datagram_received(self, data, addr):
+        """
+        Dispatches a datagram to the protocol of the client which sent it.
+        """
+        if len(data) < ClientHeader.size:
+            return
+        roomid, tankid, sequence = ClientHeader.unpack_from(data)
+        room = Rooms.get(roomid)
+        client = room.clients.get(tankid) if room is not None else None
+        # The datagram must come from the host of the TCP connection
+        if client is None or client.peer[0] != addr[0]:
+            return
+        client.datagram_received(data[ClientHeader.size:], addr, sequence)
+
+
+async def ticker(rate):
+    """
+    Flushes the messages queued in all rooms and publishes their snapshots,
+    'rate' times per second.
+    """
+    loop = asyncio.get_running_loop()
+    period = 1 / rate
+    nexttick = loop.time()
+    while True:
+        nexttick += period
+        await asyncio.sleep(max(0, nexttick - loop.time()))
+        # A room failing must not stop the others
+        for room in list(Rooms.values()):
+            try:
+                room.flush()
+                room.publish()
+            except Exception as exc:
+                print("Tick of room '{}' failed: {!r}".format(room._id, exc))
+
+
+def render_metrics():
+    """
+    Returns the lines of the Prometheus text format describing the server.
+    """
+    lines = Stats.lines()
+    lines.append("# TYPE coronatank_rooms gauge")
+    lines.append("coronatank_rooms {}".format(len(Rooms)))
+    lines.append("# TYPE coronatank_spectators gauge")
+    lines.append("coronatank_spectators {}".format(sum(len(room.spectators) for room in Rooms.values())))
+    clients = [client for room in Rooms.values() for client in room.clients.values()]
+    for name, attribute in (("client_messages_received_total", "messagesReceived"),
+                            ("client_messages_sent_total", "messagesSent"),
+                            ("client_bytes_received_total", "bytesReceived"),
+                            ("client_bytes_sent_total", "bytesSent"),
+                            ("client_messages_throttled_total", "throttled"),
+                            ("client_messages_invalid_total", "invalid"),
+                            ("client_congested", "congested"),
+                            ("client_write_buffer_bytes", None)):
+        lines.append("# TYPE coronatank_{} {}".format(name, "counter" if name.endswith("_total") else "gauge"))
+        for client in clients:
+            if attribute is None:
+                value = client.transport.get_write_buffer_size()
+            else:
+                value = int(getattr(client, attribute))
+            lines.append('coronatank_{}{{room="{}",tank="{}"}} {}'.format(name, client.room._id,
+                                                                        client._id, value))
+    return lines
+
+
+def arguments():
+    """
+    Parses the command line of the server.
+    """
     parser = argparse.ArgumentParser()
     parser.add_argument("--listen", help="IP:port of the server", required=True)
+    parser.add_argument("--tick", type=int, default=0,
+                        help="forward messages TICK times per second instead of immediately")
+    parser.add_argument("--udp", action="store_true",
+                        help="also accept state updates over UDP, on the same port")
+    parser.add_argument("--no-inbound-limit", dest="inbound_limit", action="store_false",
+                        help="do not limit the rate of the commands received from each client")
+    parser.add_argument("--metrics", help="IP:port of the HTTP endpoint serving /metrics and /profile")
+    parser.add_argument("--stats", type=float, default=0, help="print the metrics every STATS seconds")
+    parser.add_argument("--profile", type=float, default=10,
+                        help="duration of the profiling started by SIGUSR1 or /profile, in seconds")
+    parser.add_argument("--record", help="append the messages relayed to this file (see replay.py)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of worker processes, each room being hosted by one of them")
     args = parser.parse_args()
-    if args.listen:
-        ip, port = args.listen.split(":")
-        port = int(port)
+    if args.workers > 1 and (args.udp or args.metrics):
+        parser.error("--udp and --metrics are not supported with several workers")
+    return args
+
+
+async def setup(args):
+    """
+    Starts the tasks of the server, but the listening ones.
+    """
+    global Coalesce, InboundRate, Journal
+    loop = asyncio.get_running_loop()
+    # Without tick, messages are forwarded immediately and snapshots taken every frame
+    Coalesce = args.tick > 0
+    loop.create_task(ticker(args.tick if args.tick > 0 else Config.fps))
+    if args.inbound_limit:
+        # Clients send one state update per frame, whatever the tick of the server
+        InboundRate = Config.inboundPerTick * max(args.tick, Config.fps)
+    if args.record:
+        Journal = Recorder(args.record)
+        loop.create_task(Journal.run())
+
+    # Metrics and profiling
+    loop.create_task(monitor_loop(Stats.loopLag))
+    if args.stats > 0:
+        loop.create_task(dump_stats(Stats, args.stats))
+    profiler = Profiler(args.profile)
+    if hasattr(signal, 'SIGUSR1'):
+        loop.add_signal_handler(signal.SIGUSR1, profiler.start)
+    if args.metrics:
+        metricsip, metricsport = args.metrics.split(":")
+        await loop.create_server(lambda: MetricsProtocol(render_metrics, profiler),
+                                 metricsip, int(metricsport))
+
+
+async def runserver():
+    global Datagrams
+
+    # Parsing command line
+    args = arguments()
+    ip, port = args.listen.split(":")
+    port = int(port)
+
+    # With several workers, this process only dispatches the clients
+    if args.workers > 1:
+        from .supervisor import supervise
+        await supervise(ip, port, args)
+        return
 
     # Launch server
     loop = asyncio.get_running_loop()
     server = await loop.create_server(lambda: TankServerProtocol(), ip, port)
-    async with server:
-        await server.serve_forever()
+    if args.udp:
+        Datagrams, _ = await loop.create_datagram_endpoint(lambda: TankDatagramProtocol(),
+                                                           local_addr=(ip, port))
+    await setup(args)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        if Journal is not None:
+            Journal.close()
 
 
 def server():
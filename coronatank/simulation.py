@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+
+"""
+This file contains the simulation of the battlefield, independent of the display.
+"""
+
+from . import Config
+from .resources import Wall, Amunition
+from .projectiles import ProjectileStore
+from .spatial import SpatialHash
+
+
+class Simulation:
+    """
+    The tanks, projectiles and walls of a battle, advanced one tick at a time.
+    It never touches the display, so it can run headless, much faster than
+    real time: its clock counts ticks, not seconds.
+    If vectorized, the projectiles are stored in NumPy arrays (see ProjectileStore).
+    """
+
+    def __init__(self, tanks=None, walls=None, vectorized=False):
+        self.tanks = tanks if tanks is not None else []
+        self.walls = walls if walls is not None else [Wall(w[0], w[1]) for w in Config.walls]
+        self.projectiles = ProjectileStore() if vectorized else {}
+        self.remoteTanks = []
+        self.grid = SpatialHash()
+        for tank in self.tanks:
+            tank.grid = self.grid
+        self.ticks = 0
+        self.realtime = True
+
+    def headless(self):
+        """
+        Makes the tanks follow the clock of the simulation instead of the wall clock.
+        """
+        self.realtime = False
+        for tank in self.tanks:
+            tank.clock = self.time
+        return self
+
+    def time(self):
+        """
+        Returns the time of the simulation, in seconds.
+        """
+        return self.ticks / Config.fps
+
+    def add_tank(self, tank):
+        if not self.realtime:
+            tank.clock = self.time
+        tank.grid = self.grid
+        self.tanks.append(tank)
+        return tank
+
+    def step(self, commands=None, events=(), pressed=None, client=None, remoteTanks=None):
+        """
+        Advances the battle by one tick.
+        'commands' maps tanks to the command they execute, the other tanks ask their pilot.
+        'events', 'pressed' and 'client' are given to the pilots, 'remoteTanks' are the
+        tanks controlled over the network.
+        """
+        if remoteTanks is not None:
+            self.remoteTanks = remoteTanks
+        self.detonate()
+        # Index the tanks and projectiles for collision detection
+        self.grid.rebuild(self.tanks + self.remoteTanks, self.projectiles)
+        # Projectiles fired during this tick only move from the next one
+        vectorized = isinstance(self.projectiles, ProjectileStore)
+        projectiles = [] if vectorized else list(self.projectiles.values())
+        count = len(self.projectiles)
+        # Compute new positions
+        for tank in self.tanks + self.remoteTanks:
+            if commands and tank in commands:
+                tank.execute(commands[tank], self.projectiles)
+            else:
+                tank.update(events, pressed, self.projectiles, self.walls, self.tanks, client)
+        if vectorized:
+            self.projectiles.step(self.walls, count)
+        else:
+            for projectile in projectiles:
+                projectile.update(events, pressed, self.projectiles, self.walls, self.tanks, client)
+            self.cull()
+        self.ticks += 1
+
+    def detonate(self):
+        """
+        Detonates the projectiles triggered during the previous tick,
+        once their explosion could be drawn.
+        """
+        if isinstance(self.projectiles, ProjectileStore):
+            self.projectiles.detonate()
+            return
+        for projectile in self.projectiles.values():
+            if projectile.state == Amunition.States.triggered:
+                projectile.state = Amunition.States.detonated
+
+    def cull(self):
+        """
+        Removes the projectiles which have left the screen.
+        """
+        maxX, maxY = Config.screen
+        gone = [_id for _id, projectile in self.projectiles.items()
+                if not ((0 <= projectile.position[0] <= maxX) and (0 <= projectile.position[1] <= maxY))]
+        for _id in gone:
+            del(self.projectiles[_id])
+
+    def drawables(self, walls=True):
+        """
+        Returns the objects to draw, in order.
+        """
+        objects = self.tanks + self.remoteTanks + list(self.projectiles.values())
+        return self.walls + objects if walls else objects
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+
+"""
+This file contains the snapshots of the rooms, sent by the server to the clients
+which requested them instead of the state updates of each tank.
+
+Every tick, the server takes a numbered snapshot of the state of the tanks of the
+room. A client is sent the snapshot as a delta of the last one it acknowledged:
+a snapshot command followed by the tanks whose state changed, with only the fields
+which changed, and the tanks which left. Without any snapshot acknowledged (or one
+too old to be kept), the client is sent a keyframe: the state of all the tanks.
+Events (fire, destroyed, etc.) are still relayed as they come.
+"""
+
+from collections import OrderedDict
+
+from . import Config
+from . import Command
+
+
+# The fields of Command.fields() making the state of a tank: angle, speed, position, turret angle
+State = slice(2, 7)
+Unset = (Config.maxInt, Config.maxInt, -1, -1, Config.maxInt)
+
+Left = Command.States.left.value
+Snapshot = Command.States.snapshot.value
+Ack = Command.States.ack.value
+
+
+class World:
+    """
+    The state of the tanks of a room, built from the commands relayed by the
+    server, and its last snapshots.
+    """
+
+    def __init__(self, size=None):
+        self.size = size or Config.snapshotHistory
+        # The state of each tank, as the fields of its last commands
+        self.tanks = {}
+        self.changed = False
+        # The last snapshots, by number
+        self.history = OrderedDict()
+        self.number = 0
+
+    def update(self, fields):
+        """
+        Updates the state of a tank with the fields of a command.
+        """
+        tankid = fields[0]
+        if fields[1] == Left:
+            self.changed = self.tanks.pop(tankid, None) is not None or self.changed
+            return
+        previous = self.tanks.get(tankid, Unset)
+        state = tuple(value if value != unset else old
+                      for value, unset, old in zip(fields[State], Unset, previous))
+        if state != previous:
+            self.tanks[tankid] = state
+            self.changed = True
+
+    def snapshot(self):
+        """
+        Takes a new snapshot if the state changed since the last one.
+        Returns the number of the last snapshot.
+        """
+        if self.changed or not self.history:
+            self.number += 1
+            self.history[self.number] = dict(self.tanks)
+            if len(self.history) > self.size:
+                self.history.popitem(last=False)
+            self.changed = False
+        return self.number
+
+    def delta(self, baseline=None):
+        """
+        Returns the fields of the commands making the last snapshot, as a delta of
+        the snapshot numbered baseline, or as a keyframe if it is not kept.
+        """
+        current = self.history[self.number]
+        previous = self.history.get(baseline) if baseline is not None else None
+        if previous is None:
+            baseline, previous = -1, {}
+        commands = []
+        for tankid, state in current.items():
+            old = previous.get(tankid)
+            if old == state:
+                continue
+            if old is not None:
+                # The position is made of both coordinates
+                moved = state[2:4] != old[2:4]
+                state = tuple(value if (value != before or (moved and i in (2, 3))) else unset
+                              for i, (value, before, unset) in enumerate(zip(state, old, Unset)))
+            commands.append((tankid, -1) + state + (-1, -1))
+        for tankid in previous.keys() - current.keys():
+            commands.append((tankid, Left) + Unset + (-1, -1))
+        header = (-1, Snapshot, Config.maxInt, len(commands), -1, -1, Config.maxInt, self.number, baseline)
+        return [header] + commands
+
+
+class Reader:
+    """
+    Rebuilds the snapshots sent by the server, on the client side.
+    """
+
+    def __init__(self, size=None):
+        self.size = size or Config.snapshotHistory
+        # The last snapshots, by number: the state of each tank as
+        # (angle, speed, position, turret angle)
+        self.history = OrderedDict()
+        # The snapshot being read, the number of commands still to read and the tanks which left
+        self.number = None
+        self.tanks = None
+        self.remaining = 0
+        self.left = []
+
+    def reading(self):
+        return self.remaining > 0
+
+    def read(self, cmd):
+        """
+        Reads a command of a snapshot.
+        Returns (number, tanks, tanks which left) once the snapshot is complete, None before.
+        """
+        if cmd.state is Command.States.snapshot:
+            previous = self.history.get(cmd.touchedby, {}) if cmd.touchedby is not None else {}
+            self.number, self.tanks, self.remaining, self.left = cmd.fire, dict(previous), cmd.speed, []
+        else:
+            self.remaining -= 1
+            if cmd.state is Command.States.left:
+                self.tanks.pop(cmd.tankid, None)
+                self.left.append(cmd.tankid)
+            else:
+                state = (cmd.angle, cmd.speed, cmd.position, cmd.turretangle)
+                previous = self.tanks.get(cmd.tankid)
+                if previous is not None:
+                    state = tuple(value if value is not None else old for value, old in zip(state, previous))
+                self.tanks[cmd.tankid] = state
+        if self.remaining > 0:
+            return None
+        self.history[self.number] = self.tanks
+        if len(self.history) > self.size:
+            self.history.popitem(last=False)
+        return self.number, self.tanks, self.left
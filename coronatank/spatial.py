@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+
+"""
+This file contains the spatial hash used to find the objects close to a tank.
+"""
+
+from collections import defaultdict
+
+from . import Config
+
+
+class SpatialHash:
+    """
+    A uniform grid over the battlefield indexing the tanks and projectiles by cell.
+    It is rebuilt once per tick, then collision checks only look at the objects
+    in the cells overlapped by a tank.
+    """
+
+    def __init__(self, cellsize=None):
+        self.cellsize = cellsize or Config.gridCellSize
+        # The tanks overlapping each cell
+        self.tanks = defaultdict(list)
+        # The IDs of the projectiles in each cell
+        self.projectiles = defaultdict(list)
+
+    def rebuild(self, tanks, projectiles):
+        """
+        Indexes the tanks and the projectiles (a dict of projectiles by ID).
+        """
+        self.tanks.clear()
+        self.projectiles.clear()
+        for tank in tanks:
+            for cell in self.cells(tank.get_avg_rect()):
+                self.tanks[cell].append(tank)
+        size = self.cellsize
+        if hasattr(projectiles, 'x'):
+            # Array-backed store: compute all the cells at once
+            n = projectiles.count
+            cells = zip(projectiles.ids[:n].tolist(), (projectiles.x[:n] // size).tolist(),
+                        (projectiles.y[:n] // size).tolist())
+            for _id, cx, cy in cells:
+                self.projectiles[(cx, cy)].append(_id)
+        else:
+            for _id, projectile in projectiles.items():
+                x, y = projectile.position
+                self.projectiles[(x // size, y // size)].append(_id)
+
+    def cells(self, rect):
+        """
+        Iterates over the cells overlapped by a rect.
+        """
+        size = self.cellsize
+        for cx in range(rect.left // size, (rect.right - 1) // size + 1):
+            for cy in range(rect.top // size, (rect.bottom - 1) // size + 1):
+                yield (cx, cy)
+
+    def projectiles_near(self, rect):
+        """
+        Returns the IDs of the projectiles in the cells overlapped by rect.
+        """
+        ids = []
+        for cell in self.cells(rect):
+            if cell in self.projectiles:
+                ids.extend(self.projectiles[cell])
+        return ids
+
+    def tanks_near(self, rect):
+        """
+        Returns the tanks overlapping the cells overlapped by rect.
+        """
+        tanks = []
+        for cell in self.cells(rect):
+            for tank in self.tanks.get(cell, ()):
+                if tank not in tanks:
+                    tanks.append(tank)
+        return tanks
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+
+"""
+This file contains the cache of the pre-rendered sprites of the tanks.
+"""
+
+from collections import OrderedDict
+
+from . import Config
+
+
+class SpriteCache:
+    """
+    A LRU cache of the rotated sprites of the tanks, keyed by color, hull angle
+    and turret angle, both quantized to Config.spriteAngleStep degrees.
+    Each entry is a sprite and the offset of its center. The total size of the
+    sprites is capped to Config.spriteCacheBytes.
+    """
+
+    def __init__(self, maxbytes=None, step=None):
+        self.maxbytes = maxbytes or Config.spriteCacheBytes
+        self.step = step or Config.spriteAngleStep
+        self.sprites = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.sprites)
+
+    def quantize(self, angle):
+        return int(round(angle / self.step)) * self.step % 360
+
+    def get(self, tank):
+        """
+        Returns the sprite of the tank and the offset of its center.
+        """
+        angle, turretangle = self.quantize(tank.angle), self.quantize(tank.turret.angle)
+        key = (tuple(tank.color), angle, turretangle)
+        entry = self.sprites.get(key)
+        if entry is not None:
+            self.hits += 1
+            self.sprites.move_to_end(key)
+            return entry
+        self.misses += 1
+        surface = tank.render(angle, turretangle)
+        entry = (surface, surface.get_rect().center)
+        self.sprites[key] = entry
+        self.bytes += self.sizeof(surface)
+        # Evict the least recently used sprites
+        while self.bytes > self.maxbytes and len(self.sprites) > 1:
+            _, (evicted, _) = self.sprites.popitem(last=False)
+            self.bytes -= self.sizeof(evicted)
+        return entry
+
+    def sizeof(self, surface):
+        return surface.get_width() * surface.get_height() * surface.get_bytesize()
+
+    def clear(self):
+        self.sprites.clear()
+        self.bytes = 0
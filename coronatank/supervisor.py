@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+
+"""
+This file contains the supervisor of the server running several worker processes.
+
+The supervisor accepts the connections and reads their init request.
+Each room is hosted by a single worker (room % workers), so that messages never
+cross processes: the socket of the client and its init request are handed over
+to the worker of the room requested, or of the first room with a free seat.
+Workers report the rooms left and their load. Crashed ones are restarted.
+"""
+
+import os
+import array
+import signal
+import socket
+import asyncio
+import multiprocessing
+
+from . import Config
+from . import Command
+from . import server
+
+
+class Worker:
+    """
+    A worker process, as seen by the supervisor.
+    """
+
+    def __init__(self, index, args):
+        self.index = index
+        self.args = args
+        self.process = None
+        self.channel = None
+        # The last load reported: connections, messages received and sent, throttled
+        self.load = (0, 0, 0, 0)
+
+    def start(self):
+        self.channel, channel = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.process = multiprocessing.Process(target=work, args=(self.index, channel, self.args),
+                                               daemon=True)
+        self.process.start()
+        channel.close()
+        self.channel.setblocking(False)
+        print("Worker {} started with pid {}.".format(self.index, self.process.pid))
+
+    def handover(self, sock, initial):
+        """
+        Sends a client socket and the data already received from it to the worker.
+        """
+        fds = array.array('i', [sock.fileno()])
+        self.channel.sendmsg([initial], [(socket.SOL_SOCKET, socket.SCM_RIGHTS, fds)])
+
+    def stop(self):
+        self.channel.close()
+        self.process.join()
+
+
+class Supervisor:
+    """
+    Dispatches the clients to the workers and keeps track of the rooms.
+    """
+
+    def __init__(self, args):
+        self.args = args
+        self.workers = [Worker(i, args) for i in range(args.workers)]
+        # Store the number of clients of each room
+        self.rooms = {}
+        # Workers exiting while stopping are not restarted
+        self.stopping = False
+
+    def start(self):
+        for worker in self.workers:
+            self.watch(worker)
+
+    def watch(self, worker):
+        """
+        Starts a worker and listens to its reports and to its termination.
+        """
+        loop = asyncio.get_event_loop()
+        worker.start()
+        loop.add_reader(worker.channel.fileno(), self.report, worker)
+        loop.add_reader(worker.process.sentinel, self.restart, worker)
+
+    def restart(self, worker):
+        """
+        Restarts a crashed worker. The clients of its rooms are lost.
+        """
+        loop = asyncio.get_event_loop()
+        loop.remove_reader(worker.channel.fileno())
+        loop.remove_reader(worker.process.sentinel)
+        if self.stopping:
+            return
+        worker.stop()
+        print("Worker {} exited with code {}, restarting it.".format(worker.index, worker.process.exitcode))
+        for roomid in [roomid for roomid in self.rooms if self.worker(roomid) is worker]:
+            del(self.rooms[roomid])
+        worker.load = (0, 0, 0, 0)
+        self.watch(worker)
+
+    def report(self, worker):
+        """
+        Reads the reports of a worker.
+        """
+        while True:
+            try:
+                report = worker.channel.recv(256)
+            except OSError:
+                return
+            if not report:
+                return
+            event, value = report.decode().split(" ", 1)
+            if event == "leave":
+                roomid = int(value)
+                self.rooms[roomid] = self.rooms.get(roomid, 1) - 1
+                if self.rooms[roomid] <= 0:
+                    del(self.rooms[roomid])
+            elif event == "load":
+                worker.load = tuple(int(field) for field in value.split())
+
+    def worker(self, roomid):
+        return self.workers[roomid % len(self.workers)]
+
+    def find_room(self, roomid=None):
+        """
+        Same as server.find_room, on the number of clients of each room.
+        """
+        if roomid is None:
+            for _id, count in sorted(self.rooms.items()):
+                if count < Config.roomCapacity:
+                    return _id
+            roomid = min(range(len(self.rooms)+1) - self.rooms.keys())
+        if roomid < 0 or self.rooms.get(roomid, 0) >= Config.roomCapacity:
+            return None
+        return roomid
+
+    def dispatch(self, transport, initial):
+        """
+        Hands a new client over to the worker of its room.
+        """
+        cmd = Command().decode(initial[:Command.Msglen])
+        if cmd.state != Command.States.init:
+            transport.close()
+            return
+        # Spectators take no seat
+        if cmd.spectator:
+            roomid = cmd.room if cmd.room is not None else min(self.rooms.keys(), default=0)
+        else:
+            roomid = self.find_room(cmd.room)
+        if roomid is None or roomid < 0:
+            print("{} requested full or invalid room '{}'".format(transport.get_extra_info('peername'),
+                                                                  cmd.room))
+            transport.close()
+            return
+        if not cmd.spectator:
+            self.rooms[roomid] = self.rooms.get(roomid, 0) + 1
+        # The worker is told which room to join, even if the client did not request any
+        cmd.room = roomid
+        initial = cmd.encode() + initial[Command.Msglen:]
+        self.worker(roomid).handover(transport.get_extra_info('socket'), initial)
+        # Only the socket of the supervisor is closed, not the connection
+        transport.close()
+
+    def stop(self):
+        """
+        Terminates the workers, without restarting them.
+        """
+        self.stopping = True
+        loop = asyncio.get_event_loop()
+        for worker in self.workers:
+            loop.remove_reader(worker.channel.fileno())
+            loop.remove_reader(worker.process.sentinel)
+            worker.process.terminate()
+
+    def forward(self, signum):
+        """
+        Forwards a signal to all the workers.
+        """
+        for worker in self.workers:
+            os.kill(worker.process.pid, signum)
+
+    async def dump_load(self, period):
+        """
+        Prints the total load of the workers every period seconds.
+        """
+        while True:
+            await asyncio.sleep(period)
+            loads = [worker.load for worker in self.workers]
+            print("{} workers, {} rooms, {} connections, {} msg in, {} msg out, {} throttled".format(
+                len(self.workers), len(self.rooms), *[sum(field) for field in zip(*loads)]))
+
+
+class DispatchProtocol(asyncio.Protocol):
+    """
+    Reads the init request of a client, then hands it over to a worker.
+    """
+
+    def __init__(self, supervisor):
+        self.supervisor = supervisor
+        self.transport = None
+        self.buffer = b''
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def data_received(self, data):
+        self.buffer += data
+        if len(self.buffer) >= Command.Msglen:
+            self.transport.pause_reading()
+            self.supervisor.dispatch(self.transport, self.buffer)
+
+
+def work(index, channel, args):
+    """
+    The main function of a worker process.
+    """
+    # The supervisor handles Ctrl-C and stops the workers
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(runworker(index, channel, args))
+
+
+def accept(channel):
+    """
+    Accepts the clients handed over by the supervisor.
+    """
+    loop = asyncio.get_event_loop()
+    while True:
+        try:
+            initial, fds = recv_fds(channel)
+        except BlockingIOError:
+            return
+        if not fds:
+            return
+        sock = socket.socket(fileno=fds[0])
+        loop.create_task(loop.connect_accepted_socket(lambda initial=initial: server.TankServerProtocol(initial),
+                                                      sock))
+
+
+def recv_fds(channel):
+    """
+    Receives data and a file descriptor, as socket.recv_fds of Python 3.9.
+    """
+    fds = array.array('i')
+    data, ancdata, _, _ = channel.recvmsg(4096, socket.CMSG_SPACE(fds.itemsize))
+    for level, kind, cmsg in ancdata:
+        if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+            fds.frombytes(cmsg[:fds.itemsize])
+    return data, list(fds)
+
+
+async def report_load(channel):
+    """
+    Reports the load of the worker to the supervisor every second.
+    Returns once the supervisor is gone.
+    """
+    supervisor = os.getppid()
+    while os.getppid() == supervisor:
+        await asyncio.sleep(1)
+        channel.send("load {} {} {} {}".format(server.Stats.connections, server.Stats.messagesReceived,
+                                               server.Stats.messagesSent, server.Stats.throttled).encode())
+
+
+async def runworker(index, channel, args):
+    loop = asyncio.get_running_loop()
+    server.Channel = channel
+    # The supervisor prints the total load
+    args.stats = 0
+    # Each worker records its own rooms
+    if args.record:
+        args.record = "{}.{}".format(args.record, index)
+    await server.setup(args)
+    channel.setblocking(False)
+    loop.add_reader(channel.fileno(), accept, channel)
+    try:
+        await report_load(channel)
+    finally:
+        if server.Journal is not None:
+            server.Journal.close()
+
+
+async def supervise(ip, port, args):
+    loop = asyncio.get_running_loop()
+    supervisor = Supervisor(args)
+    supervisor.start()
+    if hasattr(signal, 'SIGUSR1'):
+        loop.add_signal_handler(signal.SIGUSR1, supervisor.forward, signal.SIGUSR1)
+    loop.create_task(supervisor.dump_load(args.stats or 10))
+    listener = await loop.create_server(lambda: DispatchProtocol(supervisor), ip, port)
+    try:
+        async with listener:
+            await listener.serve_forever()
+    finally:
+        supervisor.stop()
@@ -0,0 +1,43 @@
+"""
+The interpolation of the remote tanks by the jitter buffer.
+Run from the root of the repository with: python -m pytest
+"""
+
+import pytest
+
+from coronatank import Config, Command
+from coronatank.jitter import JitterBuffer
+
+
+def state(x, y, angle=0, speed=6):
+    return Command(tankid=1, angle=angle, speed=speed, position=(x, y), turretangle=0)
+
+
+def test_interpolation():
+    buffer = JitterBuffer(delay=0)
+    buffer.push(state(100, 200), 0)
+    buffer.push(state(110, 220), 1)
+    assert buffer.command(0.5).position == (105, 210)
+
+
+@pytest.mark.parametrize("x0, x1, expected", [(796, 802, 799), (798, 806, 2), (4, -6, 799)])
+def test_interpolation_through_the_edge(x0, x1, expected):
+    buffer = JitterBuffer(delay=0)
+    # The command stores 802 as 2, etc.
+    buffer.push(state(x0, 300), 0)
+    buffer.push(state(x1, 300), 1)
+    assert buffer.command(0.5).position == (expected, 300)
+
+
+def test_interpolation_through_the_bottom_edge():
+    buffer = JitterBuffer(delay=0)
+    buffer.push(state(100, Config.screen[1] - 2), 0)
+    buffer.push(state(100, 2), 1)
+    assert buffer.command(0.5).position == (100, 0)
+
+
+def test_extrapolation_through_the_edge():
+    buffer = JitterBuffer(delay=0)
+    buffer.push(state(Config.screen[0] - 2, 300, angle=0, speed=6), 0)
+    x, y = buffer.command(1 / Config.fps).position
+    assert (x, y) == (4, 300)
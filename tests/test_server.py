@@ -0,0 +1,148 @@
+"""
+The server driven with mock transports, without any network.
+Run from the root of the repository with: python -m pytest
+"""
+
+import sys
+import asyncio
+
+import pytest
+
+from coronatank import Config, Command
+from coronatank import server
+from coronatank.codec import Compact
+from coronatank.framing import Framer
+from coronatank.recorder import Recorder
+
+
+M = Config.maxInt
+
+
+class MockTransport:
+    """
+    A transport keeping the data written to it.
+    """
+
+    def __init__(self, port):
+        self.port = port
+        self.data = b''
+        self.closed = False
+        self.reading = True
+        self.buffered = 0
+
+    def get_extra_info(self, name):
+        return ('127.0.0.1', self.port)
+
+    def set_write_buffer_limits(self, high, low):
+        pass
+
+    def get_write_buffer_size(self):
+        return self.buffered
+
+    def write(self, data):
+        self.data += data
+
+    def pause_reading(self):
+        self.reading = False
+
+    def resume_reading(self):
+        self.reading = True
+
+    def is_closing(self):
+        return self.closed
+
+    def close(self):
+        self.closed = True
+
+    abort = close
+
+
+@pytest.fixture(autouse=True)
+def rooms(capsys):
+    server.Rooms.clear()
+    yield server.Rooms
+    server.Rooms.clear()
+
+
+def connect(port, room=0, codec=Compact):
+    """
+    Returns the protocol of a client which joined room, and its transport
+    emptied of the answer to its init request.
+    """
+    protocol = server.TankServerProtocol()
+    transport = MockTransport(port)
+    protocol.connection_made(transport)
+    protocol.data_received(Command(state=Command.States.init, room=room, codec=codec._id).encode())
+    transport.data = b''
+    return protocol, transport
+
+
+def received(transport, codec=Compact):
+    framer = Framer(codec)
+    return list(framer.commands(framer.feed(transport.data)))
+
+
+@pytest.mark.parametrize("state", [7, Command.States.init.value, Command.States.left.value,
+                                   Command.States.snapshot.value])
+def test_forged_states_are_not_relayed(state):
+    sender, _ = connect(1)
+    _, peer = connect(2)
+    invalid = server.Stats.invalid
+    sender.data_received(Compact.pack((sender._id, state, 10, 3, 100, 100, 0, -1, -1)))
+    assert peer.data == b''
+    assert sender.invalid == 1 and server.Stats.invalid == invalid + 1
+
+
+@pytest.mark.parametrize("state", [None, Command.States.operational, Command.States.destroyed])
+def test_player_states_are_relayed(state):
+    sender, _ = connect(1)
+    _, peer = connect(2)
+    cmd = Command(tankid=sender._id, state=state, angle=10, speed=3, position=(100, 100), turretangle=0)
+    sender.data_received(Compact.pack(cmd.fields()))
+    assert [relayed.fields() for relayed in received(peer)] == [cmd.fields()]
+
+
+@pytest.mark.parametrize("tick", [0, 10, 20, 100])
+def test_updates_at_frame_rate_are_not_throttled(tick, monkeypatch):
+    monkeypatch.setattr(sys, 'argv', ['server', '--listen', '127.0.0.1:0', '--tick', str(tick)])
+    monkeypatch.setattr(server, 'Coalesce', False)
+    monkeypatch.setattr(server, 'InboundRate', None)
+    asyncio.run(server.setup(server.arguments()))
+    # The clock of the token buckets advances by one frame per update
+    now = [0]
+    monkeypatch.setattr(server.time, 'monotonic', lambda: now[0])
+    sender, _ = connect(1)
+    for frame in range(3 * Config.fps):
+        now[0] += 1 / Config.fps
+        cmd = Command(tankid=sender._id, angle=frame, speed=3, position=(100, 100), turretangle=0)
+        sender.data_received(Compact.pack(cmd.fields()))
+    assert sender.throttled == 0
+
+
+@pytest.mark.parametrize("spectator", [False, True])
+def test_negative_room_is_rejected(spectator, tmp_path, monkeypatch):
+    monkeypatch.setattr(server, 'Journal', Recorder(str(tmp_path / 'journal')))
+    protocol = server.TankServerProtocol()
+    transport = MockTransport(1)
+    protocol.connection_made(transport)
+    protocol.data_received(Command(state=Command.States.init, room=-5, spectator=spectator,
+                                   codec=Compact._id).encode())
+    assert transport.closed
+    assert -5 not in server.Rooms
+    server.Journal.close()
+
+
+def test_congested_again_by_backlog():
+    async def run():
+        sender, _ = connect(1)
+        receiver, transport = connect(2)
+        receiver.pause_writing()
+        cmd = Command(tankid=sender._id, angle=10, speed=3, position=(100, 100), turretangle=0)
+        sender.data_received(Compact.pack(cmd.fields()))
+        assert transport.data == b'' and not transport.reading
+        # The backlog fills the write buffer above the high mark again
+        transport.write = lambda data: receiver.pause_writing()
+        receiver.resume_writing()
+        assert receiver.congested and not transport.reading
+        receiver.connection_lost(None)
+    asyncio.run(run())
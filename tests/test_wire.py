@@ -0,0 +1,152 @@
+"""
+Round trips of the formats exchanged over the network.
+Run from the root of the repository with: python -m pytest
+"""
+
+import pytest
+
+from coronatank import Config, Command
+from coronatank.codec import Compact, Legacy, Unset
+from coronatank.framing import Framer, RecordHeader, records
+from coronatank.snapshot import World, Reader
+
+
+M = Config.maxInt
+
+# Fields at the edges of the ranges of the compact codec
+Edges = [
+    (0, 1, 0, -128, 0, 0, 0, 0, 0),
+    (255, 255, 359, 127, 65535, 65535, 359, 2**32 - 1, 2**32 - 1),
+    (3, -1, M, M, -1, -1, M, -1, -1),
+    (-1, -1, M, M, -1, -1, M, -1, -1),
+]
+
+# Fields which do not fit: each has a single field out of range
+Overflows = [
+    (256, -1, M, M, -1, -1, M, -1, -1),
+    (1, 256, M, M, -1, -1, M, -1, -1),
+    (1, -1, M, 128, -1, -1, M, -1, -1),
+    (1, -1, M, -129, -1, -1, M, -1, -1),
+    (1, -1, M, M, 65536, 0, M, -1, -1),
+    (1, -1, M, M, 0, -2, M, -1, -1),
+    (1, -1, M, M, -1, -1, M, 2**32, -1),
+    (1, -1, M, M, -1, -1, M, -1, -2),
+]
+
+
+@pytest.mark.parametrize("fields", Edges)
+def test_compact_round_trip(fields):
+    assert Compact.fits(fields)
+    message = Compact.pack(fields)
+    assert Compact.length(message) == len(message)
+    assert [unpacked for _, unpacked in Compact.unpack(memoryview(message))] == [fields]
+
+
+def test_compact_angles_modulo():
+    fields = (1, -1, -90, M, -1, -1, 725, -1, -1)
+    (_, unpacked), = Compact.unpack(memoryview(Compact.pack(fields)))
+    assert unpacked[2] == 270 and unpacked[6] == 5
+
+
+@pytest.mark.parametrize("fields", Overflows)
+def test_compact_rejects_overflows(fields):
+    assert not Compact.fits(fields)
+    with pytest.raises(Exception):
+        Compact.pack(fields)
+
+
+@pytest.mark.parametrize("codec", [Legacy, Compact])
+def test_framer_reassembles_split_stream(codec):
+    cmds = [Command(tankid=i, angle=i, speed=2, position=(i, 3*i), turretangle=i, fire=i or None)
+            for i in range(10)]
+    stream = b''.join(codec.pack(cmd.fields()) for cmd in cmds)
+    framer = Framer(codec)
+    received = []
+    for i in range(0, len(stream), 7):
+        received.extend(framer.commands(framer.feed(stream[i:i+7])))
+    assert [cmd.fields() for cmd in received] == [cmd.fields() for cmd in cmds]
+
+
+@pytest.mark.parametrize("codec", [Legacy, Compact])
+def test_records(codec):
+    cmds = [Command(tankid=i, angle=10*i, speed=1, position=(i, i), turretangle=0) for i in range(3)]
+    datagram = b''.join(RecordHeader.pack(cmd.tankid, 1000 + i) + codec.pack(cmd.fields())
+                        for i, cmd in enumerate(cmds))
+    read = [(tankid, sequence, fields) for tankid, sequence, _, fields in records(datagram, codec)]
+    assert read == [(cmd.tankid, 1000 + i, cmd.fields()) for i, cmd in enumerate(cmds)]
+    # A truncated record ends the datagram
+    assert len(list(records(datagram[:-1], codec))) == 2
+
+
+def test_unset_matches_empty_command():
+    assert Command().fields() == Unset
+
+
+def read_snapshot(reader, world, baseline=None, codec=Compact):
+    """
+    Sends the last snapshot of world through codec to reader, returns what it read.
+    """
+    stream = b''.join(codec.pack(fields) for fields in world.delta(baseline))
+    framer = Framer(codec)
+    results = [reader.read(cmd) for cmd in framer.commands(framer.feed(stream))]
+    # Only the last command completes the snapshot
+    assert all(result is None for result in results[:-1])
+    return results[-1]
+
+
+def test_snapshot_keyframe_and_deltas():
+    world, reader = World(), Reader()
+    world.update(Command(tankid=0, angle=10, speed=3, position=(100, 200), turretangle=5).fields())
+    world.update(Command(tankid=1, angle=20, speed=0, position=(300, 400), turretangle=0).fields())
+    first = world.snapshot()
+    number, tanks, left = read_snapshot(reader, world)
+    assert number == first and left == []
+    assert tanks == {0: (10, 3, (100, 200), 5), 1: (20, 0, (300, 400), 0)}
+
+    # Events carry no state: a fire alone changes nothing
+    world.update(Command(tankid=1, fire=42).fields())
+    world.update(Command(tankid=0, angle=15, speed=3, position=(100, 210), turretangle=5).fields())
+    world.update(Command(tankid=1, state=Command.States.left).fields())
+    second = world.snapshot()
+    delta = world.delta(first)
+    # The header, the fields of tank 0 which changed and tank 1 which left
+    assert len(delta) == 3
+    assert delta[1][3] == Unset[3] and delta[1][6] == Unset[6]
+    number, tanks, left = read_snapshot(reader, world, first)
+    assert number == second and left == [1]
+    assert tanks == {0: (15, 3, (100, 210), 5)}
+
+
+def test_snapshot_position_sent_whole():
+    world, reader = World(), Reader()
+    world.update(Command(tankid=0, angle=0, speed=0, position=(50, 60), turretangle=0).fields())
+    first = world.snapshot()
+    read_snapshot(reader, world)
+    # Only one coordinate changes, both are sent
+    world.update(Command(tankid=0, angle=0, speed=0, position=(50, 61), turretangle=0).fields())
+    world.snapshot()
+    assert world.delta(first)[1][4:6] == (50, 61)
+    _, tanks, _ = read_snapshot(reader, world, first)
+    assert tanks[0][2] == (50, 61)
+
+
+def test_snapshot_keyframe_once_baseline_forgotten():
+    world = World(size=2)
+    world.update(Command(tankid=0, angle=0, speed=0, position=(1, 1), turretangle=0).fields())
+    first = world.snapshot()
+    for angle in (1, 2):
+        world.update(Command(tankid=0, angle=angle).fields())
+        world.snapshot()
+    header = world.delta(first)[0]
+    assert header[8] == -1
+    _, tanks, _ = read_snapshot(Reader(), world, first)
+    assert tanks == {0: (2, 0, (1, 1), 0)}
+
+
+def test_snapshot_unchanged_world():
+    world, reader = World(), Reader()
+    world.update(Command(tankid=0, angle=0, speed=0, position=(1, 1), turretangle=0).fields())
+    first = world.snapshot()
+    read_snapshot(reader, world)
+    assert world.snapshot() == first
+    assert len(world.delta(first)) == 1